@@ -0,0 +1,344 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from graphviz import Digraph
+from tabulate import tabulate
+from termcolor import colored
+
+import missiondata
+from cache import ResponseCache
+from common import Mission
+from extractor import WebExtractor
+from fixtures import FixtureArchive, ReplayServer
+from logger import Logger
+from missiontreegen import EXTRACTORS, format_tabulate_line
+from styler import Styler
+from treegen import build_graph, set_graph_attrs, write_dot
+
+STYLE_ATTRIBUTES = {
+    'background_color': ['#ffcccc', '#ccffcc', '#ccccff', '#ffffcc'],
+    'line_color': ['red', 'green', 'blue', 'black'],
+    'shape': ['box', 'ellipse', 'hexagon', 'note'],
+    'style': ['filled', 'filled,rounded', 'filled,dashed'],
+    'font_size': ['10', '12', '14'],
+    'font_color': ['black', 'white', 'grey20'],
+}
+
+
+class NullGraph:
+    # Accepts nodes without building anything, so only the time spent styling them is measured
+    def node(self, name, label=None, _attributes=None, **attrs):
+        pass
+
+
+def generate_missions(mission_count: int, part_size: int, tag_count: int, tag_pool: int, fan_in: int,
+                      window: int, seed: int) -> list[tuple[str, list[Mission]]]:
+    # Missions only depend on earlier ones within window missions of them, so the graph is acyclic and mostly local
+    rng = random.Random(seed)
+    tags = [f'tag.{i}' for i in range(tag_pool)]
+    parts = []
+    for i in range(mission_count):
+        if i % part_size == 0:
+            parts.append((f'Part {len(parts) + 1}', []))
+
+        candidates = range(max(0, i - window), i)
+        depends_on = [f'wikimission_{j}' for j in rng.sample(candidates, min(len(candidates), rng.randint(0, fan_in)))]
+        mission = Mission(f'Mission {i}', f'/wiki/Mission_{i}', depends_on,
+                          rng.sample(tags, min(tag_pool, tag_count)))
+        parts[-1][1].append(mission)
+    return parts
+
+
+def generate_style(rule_count: int, tag_pool: int, mission_count: int, engine: str, seed: int) -> dict:
+    # Mostly tag selectors, with an id selector for every tenth rule
+    rng = random.Random(seed)
+    style = {'engine': engine, 'default': {'background_color': 'white', 'style': 'filled'}}
+    for i in range(rule_count):
+        if i % 10 == 9:
+            selector = f'#wikimission_{rng.randrange(mission_count)}'
+        else:
+            selector = f'tag.{i % tag_pool}'
+        style[selector] = {name: rng.choice(values) for name, values in rng.sample(list(STYLE_ATTRIBUTES.items()), 3)}
+    return style
+
+
+def write_dataset(path: str, output_format: str, parts: list[tuple[str, list[Mission]]], compact: bool = False):
+    writer = missiondata.make_writer(path, output_format, 'benchmark', compact)
+    for title, missions in parts:
+        writer.add_part(title)
+        for mission in missions:
+            writer.add_mission(mission)
+    writer.close()
+
+
+def read_dataset(path: str) -> list[dict]:
+    return [{'title': part['title'], 'missions': list(part['missions'])} for part in missiondata.read_parts(path)]
+
+
+def time_runs(func, repeat: int) -> list[float]:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def make_result(name: str, missions: int, edges: int, runs: list[float]) -> dict:
+    return {
+        'name': name,
+        'missions': missions,
+        'edges': edges,
+        'runs': runs,
+        'best': min(runs),
+        'median': statistics.median(runs),
+    }
+
+
+def benchmark_size(args, mission_count: int, work_dir: str) -> list[dict]:
+    parts = generate_missions(mission_count, args.part_size, args.tags, args.tag_pool, args.fan_in, args.window,
+                              args.seed)
+    edge_count = sum(len(mission.depends_on) for _, missions in parts for mission in missions)
+    results = []
+
+    def add_result(name, func):
+        Logger.log_verbose('Running %s with %d missions', name, mission_count)
+        results.append(make_result(name, mission_count, edge_count, time_runs(func, args.repeat)))
+
+    for output_format in missiondata.FORMATS:
+        path = os.path.join(work_dir, f'missions-{mission_count}.{output_format}')
+        add_result(f'write_{output_format}', lambda: write_dataset(path, output_format, parts))
+        add_result(f'load_{output_format}', lambda: read_dataset(path))
+
+    compact_path = os.path.join(work_dir, f'missions-{mission_count}-compact.json')
+    add_result('write_json_compact', lambda: write_dataset(compact_path, 'json', parts, compact=True))
+    add_result('load_json_compact', lambda: read_dataset(compact_path))
+
+    data = read_dataset(os.path.join(work_dir, f'missions-{mission_count}.json'))
+    missions = [mission for part in data for mission in part['missions']]
+
+    style_path = os.path.join(work_dir, f'style-{mission_count}.json')
+    with open(style_path, 'w', encoding='utf-8') as f:
+        json.dump(generate_style(args.style_rules, args.tag_pool, mission_count, args.style_engine, args.seed), f)
+
+    def resolve_styles():
+        Styler.load_style(style_path)
+        for mission in missions:
+            Styler.get_style(mission['id'], mission['tags'])
+
+    def make_nodes():
+        Styler.load_style(style_path)
+        graph = NullGraph()
+        for mission in missions:
+            Styler.make_node(graph, mission['id'], mission['title'], mission['tags'])
+
+    add_result('style_resolution', resolve_styles)
+    add_result('make_node', make_nodes)
+
+    graph_args = argparse.Namespace(dpi='96', subgraphs=args.subgraphs)
+    source = io.StringIO()
+
+    def build_digraph():
+        dot = Digraph(comment='Mission Dependency Graph', engine=args.engine)
+        set_graph_attrs(dot, graph_args.dpi)
+        build_graph(dot, data, graph_args.subgraphs)
+        return dot.source
+
+    def build_dot_writer():
+        source.seek(0)
+        source.truncate()
+        write_dot(source, data, graph_args)
+
+    Styler.load_style(style_path)
+    add_result('dot_digraph', build_digraph)
+    add_result('dot_writer', build_dot_writer)
+
+    if mission_count > args.layout_max:
+        Logger.log_info('Skipping layout of %d missions, larger than --layout-max', mission_count, color='yellow')
+    elif shutil.which(args.engine) is None:
+        Logger.log_info('Skipping layout, %s was not found', args.engine, color='yellow')
+    else:
+        def run_layout():
+            subprocess.run([args.engine, '-Tsvg', '-o', os.devnull], input=source.getvalue(), encoding='utf-8',
+                           check=True)
+
+        add_result(f'layout_{args.engine}', run_layout)
+
+    return results
+
+
+def benchmark_extractor(args) -> dict | None:
+    # Runs the extractor against pages saved by a previous `extract --cache-dir`, or recorded by `extract --record` and
+    # served from a local server, without accessing the network
+    WebExtractor.set_parser(args.parser)
+    WebExtractor.set_jobs(args.jobs)
+    WebExtractor.set_parse_jobs(args.parse_jobs)
+    WebExtractor.set_use_api(args.api)
+    if args.extract_replay is not None:
+        server = ReplayServer(FixtureArchive(args.extract_replay))
+        if server.origin is None:
+            Logger.log_info('No responses recorded in "%s"', args.extract_replay, color='red')
+            server.server_close()
+            return None
+        server.start()
+        WebExtractor.set_origin(server.origin, server.url)
+        try:
+            return run_extractor_benchmark(args, args.extract_replay)
+        finally:
+            server.stop()
+
+    WebExtractor.set_cache(ResponseCache(args.extract_cache, math.inf), offline=True)
+    return run_extractor_benchmark(args, args.extract_cache)
+
+
+def run_extractor_benchmark(args, source: str) -> dict | None:
+    mission_count = 0
+
+    def extract():
+        nonlocal mission_count
+        extractor = EXTRACTORS[args.extractor]()
+        parts = extractor.get_parts()
+        if parts is None:
+            raise RuntimeError(f'the pages of {args.extractor} are not in {source}')
+
+        mission_count = 0
+        for part in parts:
+            for _ in extractor.get_missions(part.title):
+                mission_count += 1
+
+    Logger.log_verbose('Running extract_%s', args.extractor)
+    try:
+        runs = time_runs(extract, args.repeat)
+    except RuntimeError as e:
+        Logger.log_info('Extractor benchmark failed: %s', e, color='red')
+        return None
+    return make_result(f'extract_{args.extractor}', mission_count, 0, runs)
+
+
+def print_results(results: list[dict], baseline: dict | None):
+    previous = {}
+    if baseline is not None:
+        previous = {(result['name'], result['missions']): result['best'] for result in baseline['results']}
+
+    table = []
+    for result in results:
+        row = [result['name'], result['missions'], result['edges'], result['best'], result['median']]
+        if baseline is not None:
+            before = previous.get((result['name'], result['missions']))
+            if before is None or before == 0:
+                row.append('')
+            else:
+                change = result['best'] / before
+                row.append(colored(f'{change:.2f}x', 'red' if change > 1.1 else 'green' if change < 0.9 else 'white'))
+        table.append(row)
+
+    headers = ['BENCHMARK', 'MISSIONS', 'EDGES', 'BEST', 'MEDIAN']
+    if baseline is not None:
+        headers.append('VS BASELINE')
+    print(format_tabulate_line(tabulate(table, headers, tablefmt='plain', floatfmt='.4f'), '\t{line}'))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark', description='Benchmarks the mission tree generator on synthetic '
+                                                                   'data')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='enable verbose logging (repeat to increase level of verbosity)')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of missions to generate (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='times to run each benchmark (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the generated data (default: %(default)s)')
+    parser.add_argument('--part-size', type=int, default=100, help='missions per part (default: %(default)s)')
+    parser.add_argument('--tags', type=int, default=3, help='tags per mission (default: %(default)s)')
+    parser.add_argument('--tag-pool', type=int, default=50, help='number of distinct tags (default: %(default)s)')
+    parser.add_argument('--fan-in', type=int, default=3,
+                        help='maximum dependencies per mission (default: %(default)s)')
+    parser.add_argument('--window', type=int, default=200,
+                        help='how many missions back a dependency can be (default: %(default)s)')
+    parser.add_argument('--style-rules', type=int, default=100, help='rules in the style (default: %(default)s)')
+    parser.add_argument('--style-engine', choices=['gv', 'html'], default='gv',
+                        help='style engine (default: %(default)s)')
+    parser.add_argument('--subgraphs', action='store_true', help='draw borders around each part')
+    parser.add_argument('--engine', default='dot', help='the layout engine (default: %(default)s)')
+    parser.add_argument('--layout-max', type=int, default=1000,
+                        help='largest number of missions to lay out (default: %(default)s)')
+    parser.add_argument('--extractor', default='rdr', help='the extractor to benchmark (default: %(default)s)')
+    parser.add_argument('--extract-cache', required=False,
+                        help='page cache from `extract --cache-dir` to benchmark the extractor against offline')
+    parser.add_argument('--extract-replay', required=False,
+                        help='responses recorded with `extract --record` to benchmark the extractor against')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of pages the extractor fetches at once (default: %(default)s)')
+    parser.add_argument('--parse-jobs', type=int, default=1,
+                        help='number of processes the extractor parses pages in (default: %(default)s)')
+    parser.add_argument('--api', action='store_true',
+                        help='look up redirects and revisions with batched API queries in the extractor benchmark')
+    parser.add_argument('--parser', choices=WebExtractor.parsers, help='the HTML parser for the extractor benchmark')
+    parser.add_argument('--output', required=False, help='file to write the results to as JSON')
+    parser.add_argument('--baseline', required=False, help='results of an earlier run to compare against')
+
+    args = parser.parse_args()
+    Logger.set_level(args.verbose)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='missiontreegen-benchmark-')
+    try:
+        for size in args.sizes.split(','):
+            results.extend(benchmark_size(args, int(size), work_dir))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.extract_cache is not None or args.extract_replay is not None:
+        try:
+            result = benchmark_extractor(args)
+        finally:
+            WebExtractor.close_parse_pool()
+        if result is not None:
+            results.append(result)
+
+    print_results(results, baseline)
+
+    if args.output is not None:
+        report = {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        Logger.log_info('Results saved to %s', args.output)
+
+
+if __name__ == '__main__':
+    main()
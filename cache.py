@@ -0,0 +1,146 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import dataclasses
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    status: int
+    fetched_at: float
+    body_hash: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+# Response bodies are stored once under objects/, named by the SHA-256 of their content. Each URL has a small JSON entry
+# under index/ pointing at its body, along with the validators needed to revalidate it.
+class ResponseCache:
+    def __init__(self, cache_dir: str, ttl: float | None = None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.index_dir = os.path.join(cache_dir, 'index')
+        self.redirects_path = os.path.join(cache_dir, 'redirects.jsonl')
+        self.redirects_lock = threading.Lock()
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    @staticmethod
+    def hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def get_index_path(self, key: str) -> str:
+        return os.path.join(self.index_dir, ResponseCache.hash(key.encode('utf-8')) + '.json')
+
+    def get_object_path(self, body_hash: str) -> str:
+        return os.path.join(self.objects_dir, body_hash)
+
+    @staticmethod
+    def write_atomic(path: str, data: bytes):
+        # Write to a temporary file first so that a crash or a concurrent reader never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key: str) -> CacheEntry | None:
+        try:
+            with open(self.get_index_path(key), 'r', encoding='utf-8') as f:
+                return CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        if self.ttl is None:
+            return True
+        return time.time() - entry.fetched_at < self.ttl
+
+    def read_body(self, entry: CacheEntry) -> bytes | None:
+        if entry.body_hash is None:
+            return None
+        try:
+            with open(self.get_object_path(entry.body_hash), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_entry(self, key: str, entry: CacheEntry):
+        ResponseCache.write_atomic(self.get_index_path(key),
+                                   json.dumps(dataclasses.asdict(entry)).encode('utf-8'))
+
+    def put(self, key: str, url: str, status: int, body: bytes | None = None, headers=None) -> CacheEntry:
+        body_hash = None
+        if body is not None:
+            body_hash = ResponseCache.hash(body)
+            object_path = self.get_object_path(body_hash)
+            if not os.path.exists(object_path):
+                ResponseCache.write_atomic(object_path, body)
+
+        entry = CacheEntry(url, status, time.time(), body_hash)
+        if headers is not None:
+            entry.etag = headers.get('ETag')
+            entry.last_modified = headers.get('Last-Modified')
+
+        self.write_entry(key, entry)
+        return entry
+
+    def touch(self, key: str, entry: CacheEntry):
+        entry.fetched_at = time.time()
+        self.write_entry(key, entry)
+
+    @staticmethod
+    def get_validators(entry: CacheEntry) -> dict[str, str]:
+        headers = {}
+        if entry.etag is not None:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified is not None:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def load_redirects(self, include_stale: bool = False) -> dict[str, str]:
+        redirects = {}
+        try:
+            with open(self.redirects_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A partially written line from an interrupted run
+                        continue
+                    if include_stale or self.ttl is None or time.time() - record['fetched_at'] < self.ttl:
+                        redirects[record['url']] = record['final']
+        except OSError:
+            pass
+        return redirects
+
+    def add_redirects(self, redirects: dict[str, str]):
+        fetched_at = time.time()
+        lines = ''.join(json.dumps({'url': url, 'final': final, 'fetched_at': fetched_at}) + '\n'
+                        for url, final in redirects.items())
+        with self.redirects_lock, open(self.redirects_path, 'a', encoding='utf-8') as f:
+            f.write(lines)
@@ -0,0 +1,64 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+
+from common import EnhancedJSONEncoder, Mission
+
+
+# Records each finished part on its own line, so an interrupted extraction can pick up where it left off. The first
+# line names the extractor, so a checkpoint is never resumed with a different one.
+class Checkpoint:
+    def __init__(self, path: str, extractor_name: str):
+        self.path = path
+        self.extractor_name = extractor_name
+
+    def load(self) -> dict[str, list[Mission]]:
+        parts = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('extractor') != self.extractor_name:
+                    return {}
+
+                for line in f:
+                    try:
+                        part = json.loads(line)
+                    except ValueError:
+                        # The run was interrupted while writing this part
+                        break
+                    parts[part['title']] = [Mission.from_dict(mission) for mission in part['missions']]
+        except (OSError, ValueError):
+            return {}
+        return parts
+
+    def start(self, parts: dict[str, list[Mission]]):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'extractor': self.extractor_name}) + '\n')
+        for title, missions in parts.items():
+            self.add_part(title, missions)
+
+    def add_part(self, title: str, missions: list[Mission]):
+        line = json.dumps({'title': title, 'missions': missions}, ensure_ascii=False, cls=EnhancedJSONEncoder)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -12,32 +12,65 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import dataclasses
+import functools
+import json
 import re
+import sys
 from dataclasses import dataclass
 
+# The fastest parser that is installed is used unless one is chosen explicitly
+HTML_PARSERS = ['lxml', 'html.parser']
 
-@dataclass
+NON_WORD = re.compile(r'\W+')
+
+
+@dataclass(slots=True)
 class Part:
     title: str
 
+    def to_dict(self) -> dict:
+        return {'title': self.title}
 
-@dataclass
+
+# Ids, dependencies and tags repeat across missions, so they are interned and every mission shares the same strings
+@dataclass(slots=True)
 class Mission:
     title: str
     id: str
     path: str
     depends_on: list[str]
     tags: list[str]
+    revision: int | None
 
-    def __init__(self, title: str, path: str, depends_on: list[str], tags: list[str]):
-        super().__init__()
+    def __init__(self, title: str, path: str, depends_on: list[str], tags: list[str], revision: int | None = None):
         self.title = title
         self.path = path
-        self.depends_on = depends_on
-        self.tags = tags
+        self.depends_on = [sys.intern(dependency) for dependency in depends_on]
+        self.tags = [sys.intern(tag) for tag in tags]
+        self.revision = revision
 
         self.id = Mission.sanitize_string(self.path)
 
     @staticmethod
+    @functools.lru_cache(maxsize=65536)
     def sanitize_string(path: str) -> str:
-        return re.sub(r'\W+', '', path).lower()
+        return sys.intern(NON_WORD.sub('', path).lower())
+
+    @staticmethod
+    def from_dict(data: dict) -> 'Mission':
+        return Mission(data['title'], data['path'], data['depends_on'], data['tags'], data.get('revision'))
+
+    def to_dict(self) -> dict:
+        # The lists are shared with the mission rather than copied, which is all the JSON encoder needs
+        return {'title': self.title, 'id': self.id, 'path': self.path, 'depends_on': self.depends_on,
+                'tags': self.tags, 'revision': self.revision}
+
+
+class EnhancedJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, (Mission, Part)):
+            return o.to_dict()
+        if dataclasses.is_dataclass(o):
+            return dataclasses.asdict(o)
+        return super().default(o)
@@ -0,0 +1,115 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import subprocess
+from contextlib import contextmanager
+from typing import TextIO
+
+from graphviz.quoting import attr_list, quote
+
+
+class DotSubgraph:
+    def __init__(self, name: str):
+        self.name = name
+        self.attrs = {}
+        self.edges = []
+
+    def attr(self, **kwargs):
+        self.attrs |= kwargs
+
+    def edge(self, tail_name, head_name):
+        self.edges.append((tail_name, head_name))
+
+
+# Writes DOT source to a file or pipe in one pass, with the same node, edge, attr and subgraph methods as a
+# graphviz.Digraph so the same code can build either.
+#
+# Nodes are grouped by their attributes across the whole graph. Each set of attributes shared by several nodes is
+# written once, as the node defaults of an anonymous subgraph holding all of those nodes, which does not affect the
+# layout. A node whose attributes no other node has is written with them inline. Nodes, edges and clusters are written
+# when the writer is closed, with every node declared before the edges, so that a node referenced by an edge is never
+# created with the wrong defaults.
+class DotWriter:
+    def __init__(self, file: TextIO, comment: str | None = None):
+        self.file = file
+        # Node attributes to the name, label and node specific attributes of every node that has them
+        self.node_classes: dict[tuple, list[tuple]] = {}
+        self.edges = []
+        self.subgraphs = []
+
+        if comment is not None:
+            self.file.write(f'// {comment}\n')
+        self.file.write('digraph {\n')
+
+    def attr(self, **kwargs):
+        for key, value in kwargs.items():
+            self.file.write(f'\t{quote(key)}={quote(value)}\n')
+
+    def node(self, name, label=None, _attributes=None, **attrs):
+        # Attributes passed in _attributes are specific to this node, so they are not shared with other nodes
+        self.node_classes.setdefault(tuple(attrs.items()), []).append((name, label, _attributes))
+
+    def write_nodes(self):
+        for node_class, nodes in self.node_classes.items():
+            if len(node_class) == 0 or len(nodes) == 1:
+                attrs = dict(node_class)
+                for name, label, attributes in nodes:
+                    self.file.write(f'\t{quote(name)}{attr_list(label, attrs, attributes)}\n')
+                continue
+
+            self.file.write(f'\t{{\n\t\tnode{attr_list(None, dict(node_class))}\n')
+            for name, label, attributes in nodes:
+                self.file.write(f'\t\t{quote(name)}{attr_list(label, attributes=attributes)}\n')
+            self.file.write('\t}\n')
+        self.node_classes = {}
+
+    def edge(self, tail_name, head_name):
+        self.edges.append((tail_name, head_name))
+
+    @contextmanager
+    def subgraph(self, name: str):
+        subgraph = DotSubgraph(name)
+        self.subgraphs.append(subgraph)
+        yield subgraph
+
+    def close(self):
+        self.write_nodes()
+
+        for tail_name, head_name in self.edges:
+            self.file.write(f'\t{quote(tail_name)} -> {quote(head_name)}\n')
+
+        for subgraph in self.subgraphs:
+            self.file.write(f'\tsubgraph {quote(subgraph.name)} {{\n')
+            for key, value in subgraph.attrs.items():
+                self.file.write(f'\t\t{quote(key)}={quote(value)}\n')
+            for tail_name, head_name in subgraph.edges:
+                self.file.write(f'\t\t{quote(tail_name)} -> {quote(head_name)}\n')
+            self.file.write('\t}\n')
+
+        self.file.write('}\n')
+
+
+@contextmanager
+def open_layout_pipe(engine: str, fmt: str, output_path: str, extra_args=()):
+    # Streams the DOT source into the layout engine's stdin, instead of building it in memory first
+    process = subprocess.Popen([engine, f'-T{fmt}', '-o', output_path, *extra_args], stdin=subprocess.PIPE,
+                               encoding='utf-8')
+    try:
+        yield process.stdin
+    finally:
+        process.stdin.close()
+        return_code = process.wait()
+
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, process.args)
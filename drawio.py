@@ -0,0 +1,169 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import html
+import json
+import re
+import subprocess
+from xml.sax.saxutils import quoteattr
+
+# Graphviz works in points, with y increasing upwards
+POINTS_PER_INCH = 72
+
+SHAPES = {
+    'box': 'rounded=0',
+    'rect': 'rounded=0',
+    'rectangle': 'rounded=0',
+    'square': 'rounded=0',
+    'plaintext': 'text',
+    'plain': 'text',
+    'none': 'text',
+    'ellipse': 'ellipse',
+    'oval': 'ellipse',
+    'circle': 'ellipse;aspect=fixed',
+    'doublecircle': 'ellipse;shape=doubleEllipse;aspect=fixed',
+    'diamond': 'rhombus',
+    'triangle': 'triangle;direction=north',
+    'hexagon': 'shape=hexagon;perimeter=hexagonPerimeter2',
+    'parallelogram': 'shape=parallelogram;perimeter=parallelogramPerimeter',
+    'trapezium': 'shape=trapezoid;perimeter=trapezoidPerimeter',
+    'cylinder': 'shape=cylinder3',
+    'note': 'shape=note',
+    'tab': 'shape=folder',
+}
+
+
+def layout(source: str, engine: str) -> dict:
+    # Lays the graph out once and reads the positions back, instead of rendering an image
+    result = subprocess.run([engine, '-Tjson'], input=source, encoding='utf-8', capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f'{engine} exited with code {result.returncode}')
+    return json.loads(result.stdout)
+
+
+def parse_point(value: str, height: float) -> tuple[float, float]:
+    x, y = value.split(',')[:2]
+    return float(x), height - float(y)
+
+
+def parse_spline(value: str, height: float) -> list[tuple[float, float]]:
+    # The start and end points of the arrowheads are not part of the spline itself
+    return [parse_point(token, height) for token in value.split(';')[0].split()
+            if not token.startswith('s,') and not token.startswith('e,')]
+
+
+def get_label(obj: dict) -> str:
+    label = obj.get('label', '\\N')
+    if label == '\\N':
+        return obj['name']
+    if label.startswith('<') and label.endswith('>'):
+        # HTML-like label, keep only its text
+        return html.unescape(re.sub(r'<[^>]*>', '', label).strip('<>'))
+    return label
+
+
+def get_node_style(node: dict) -> str:
+    styles = node.get('style', '').split(',')
+    style = [SHAPES.get(node.get('shape', 'ellipse'), 'rounded=0'), 'whiteSpace=wrap', 'html=1']
+
+    if 'rounded' in styles:
+        style.append('rounded=1')
+    if 'dashed' in styles:
+        style.append('dashed=1')
+    if 'dotted' in styles:
+        style.append('dashed=1;dashPattern=1 2')
+    if 'invis' in styles:
+        style.append('opacity=0;textOpacity=0')
+
+    if 'filled' in styles:
+        style.append(f'fillColor={node.get('fillcolor', node.get('color', 'lightgrey'))}')
+    else:
+        style.append('fillColor=none')
+
+    style.append(f'strokeColor={node.get('color', 'black')}')
+    if 'penwidth' in node:
+        style.append(f'strokeWidth={node['penwidth']}')
+    if 'fontcolor' in node:
+        style.append(f'fontColor={node['fontcolor']}')
+    if 'fontname' in node:
+        style.append(f'fontFamily={node['fontname']}')
+    if 'fontsize' in node:
+        style.append(f'fontSize={node['fontsize']}')
+    if 'image' in node:
+        style.append(f'image={node['image']}')
+    if 'href' in node:
+        style.append(f'link={node['href']}')
+
+    return ';'.join(style) + ';'
+
+
+def make_cell(cell_id: str, value: str, style: str, attrs: str, geometry: str) -> str:
+    return (f'<mxCell id={quoteattr(cell_id)} value={quoteattr(value)} style={quoteattr(style)} {attrs}>'
+            f'{geometry}</mxCell>')
+
+
+def convert(graph: dict) -> str:
+    bb = [float(value) for value in graph['bb'].split(',')]
+    height = bb[3]
+
+    cells = []
+    for obj in graph.get('objects', []):
+        if 'nodes' in obj:
+            # Only clusters are drawn, other subgraphs do not change how the graph looks
+            if not obj['name'].startswith('cluster') or 'bb' not in obj:
+                continue
+            x1, y1, x2, y2 = [float(value) for value in obj['bb'].split(',')]
+            style = (f'rounded=0;whiteSpace=wrap;html=1;fillColor=none;verticalAlign=top;'
+                     f'strokeColor={obj.get('color', 'black')};'
+                     + ('dashed=1;' if 'dashed' in obj.get('style', '') else ''))
+            geometry = f'<mxGeometry x="{x1}" y="{height - y2}" width="{x2 - x1}" height="{y2 - y1}" as="geometry"/>'
+            cells.append(make_cell(f'cluster{obj['_gvid']}', obj.get('label', ''), style, 'vertex="1" parent="1"',
+                                   geometry))
+
+    for obj in graph.get('objects', []):
+        if 'nodes' in obj or 'pos' not in obj:
+            continue
+        x, y = parse_point(obj['pos'], height)
+        width = float(obj['width']) * POINTS_PER_INCH
+        node_height = float(obj['height']) * POINTS_PER_INCH
+        geometry = (f'<mxGeometry x="{x - width / 2}" y="{y - node_height / 2}" width="{width}" '
+                    f'height="{node_height}" as="geometry"/>')
+        cells.append(make_cell(f'node{obj['_gvid']}', get_label(obj), get_node_style(obj), 'vertex="1" parent="1"',
+                               geometry))
+
+    for edge in graph.get('edges', []):
+        style = f'curved=1;html=1;endArrow=classic;strokeColor={edge.get('color', 'black')};'
+        points = ''
+        if 'pos' in edge:
+            spline = parse_spline(edge['pos'], height)
+            # Every third point of a spline is on the curve, the others are control points
+            waypoints = spline[3:-1:3]
+            points = '<Array as="points">' + ''.join(f'<mxPoint x="{x}" y="{y}"/>' for x, y in waypoints) + '</Array>'
+        geometry = f'<mxGeometry relative="1" as="geometry">{points}</mxGeometry>'
+        attrs = f'edge="1" parent="1" source="node{edge['tail']}" target="node{edge['head']}"'
+        cells.append(make_cell(f'edge{edge['_gvid']}', '', style, attrs, geometry))
+
+    return ('<mxfile host="missiontreegen"><diagram name="Page-1" id="missiontreegen">'
+            f'<mxGraphModel dx="{bb[2]}" dy="{bb[3]}" grid="1" gridSize="10" guides="1" tooltips="1" connect="1" '
+            f'arrows="1" fold="1" page="1" pageScale="1" pageWidth="{bb[2]}" pageHeight="{bb[3]}" math="0" '
+            'shadow="0"><root><mxCell id="0"/><mxCell id="1" parent="0"/>'
+            + ''.join(cells) +
+            '</root></mxGraphModel></diagram></mxfile>')
+
+
+def render(source: str, engine: str, output_path: str) -> dict:
+    graph = layout(source, engine)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(convert(graph))
+    return graph
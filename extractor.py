@@ -12,19 +12,38 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import multiprocessing
+import re
+import threading
 import urllib
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.error import HTTPError
 from urllib.request import Request, urlopen
 
 import requests
-from bs4 import BeautifulSoup
-from termcolor import colored
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
 
-from common import Mission, Part
+from cache import ResponseCache
+from common import HTML_PARSERS, Mission, Part
+from fixtures import FixtureArchive, get_origin
 from logger import Logger
+from profiler import Profiler
+
+# The MediaWiki API accepts up to 50 titles per query
+API_TITLES_PER_QUERY = 50
+# Characters MediaWiki leaves unescaped in article URLs
+TITLE_SAFE_CHARS = ';@$!*(),/~:'
 
 
 class Extractor:
+    # Missions from a previous extraction, keyed by path, that may be reused if their page has not changed
+    previous_missions: dict[str, Mission] = {}
+
+    def set_previous_missions(self, missions: dict[str, Mission]):
+        self.previous_missions = missions
+
     def get_description(self) -> str:
         pass
 
@@ -34,41 +53,475 @@ class Extractor:
     def get_parts(self) -> list[Part]:
         pass
 
-    def get_missions(self, part_title) -> list[Mission]:
+    def get_missions(self, part_title) -> Iterable[Mission]:
         pass
 
 
 class WebExtractor:
-    def __init__(self, base_url):
+    jobs: int = 1
+    # Pages are parsed in this many worker processes, or in the calling thread when it is 1
+    parse_jobs: int = 1
+    parse_pool: ProcessPoolExecutor | None = None
+    cache: ResponseCache | None = None
+    offline: bool = False
+    # Maps every URL seen so far (without fragment) to the URL it finally redirects to
+    redirects: dict[str, str] = {}
+    redirects_lock = threading.Lock()
+    sessions = threading.local()
+    parsers = HTML_PARSERS
+    parser: str | None = None
+    # Archive every response is recorded to, and the origins whose requests go to a local server replaying one instead
+    recorder: FixtureArchive | None = None
+    origins: dict[str, str] = {}
+    # Look up redirects and revisions with batched API queries instead of following each link. Revisions found that
+    # way are kept by URL, so they do not need another query.
+    use_api: bool = False
+    revisions: dict[str, int] = {}
+
+    def __init__(self, base_url, api_path=None, article_path='/wiki/', parse_only: SoupStrainer | None = None):
         self.base_url = base_url
+        self.parse_only = parse_only
+        self.api_path = api_path
+        self.article_path = article_path
 
-    def get_soup(self, path):
-        url = urllib.parse.urljoin(self.base_url, path)
-        Logger.log_debug(colored(f'Loading URL "{url}"', 'cyan'))
+    @staticmethod
+    def set_jobs(jobs: int):
+        WebExtractor.jobs = max(1, jobs)
+
+    @staticmethod
+    def set_parse_jobs(jobs: int):
+        WebExtractor.parse_jobs = max(1, jobs)
+
+    @staticmethod
+    def get_parse_pool() -> ProcessPoolExecutor:
+        if WebExtractor.parse_pool is None:
+            # The fetch threads are already running, so forking could copy a lock one of them holds into a worker.
+            # The workers are started from a clean process instead.
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            WebExtractor.parse_pool = ProcessPoolExecutor(max_workers=WebExtractor.parse_jobs,
+                                                          mp_context=multiprocessing.get_context(method),
+                                                          initializer=Logger.set_level, initargs=(Logger.level,))
+        return WebExtractor.parse_pool
+
+    @staticmethod
+    def close_parse_pool():
+        if WebExtractor.parse_pool is not None:
+            WebExtractor.parse_pool.shutdown()
+            WebExtractor.parse_pool = None
+
+    @staticmethod
+    def set_parser(parser: str | None):
+        WebExtractor.parser = parser
+
+    @staticmethod
+    def get_parser() -> str:
+        if WebExtractor.parser is None:
+            for parser in WebExtractor.parsers:
+                try:
+                    BeautifulSoup('', parser)
+                except FeatureNotFound:
+                    continue
+                WebExtractor.parser = parser
+                break
+            Logger.log_debug('Using HTML parser "%s"', WebExtractor.parser, color='cyan')
+        return WebExtractor.parser
+
+    @staticmethod
+    def set_cache(cache: ResponseCache | None, offline: bool = False):
+        WebExtractor.cache = cache
+        WebExtractor.offline = offline
+        if cache is not None:
+            with WebExtractor.redirects_lock:
+                WebExtractor.redirects |= cache.load_redirects(include_stale=offline)
+
+    @staticmethod
+    def set_use_api(use_api: bool):
+        WebExtractor.use_api = use_api
+
+    @staticmethod
+    def set_recorder(recorder: FixtureArchive | None):
+        WebExtractor.recorder = recorder
+
+    @staticmethod
+    def set_origin(origin: str, local_origin: str):
+        WebExtractor.origins[origin] = local_origin
+
+    @staticmethod
+    def to_transport(url: str) -> str:
+        # The URL a request is actually sent to. Everything else only ever sees the original URL, so the output of a
+        # replayed extraction is the same as the recorded one.
+        local_origin = WebExtractor.origins.get(get_origin(url))
+        if local_origin is None:
+            return url
+        return local_origin + url.removeprefix(get_origin(url))
+
+    @staticmethod
+    def from_transport(url: str) -> str:
+        origin = get_origin(url)
+        for live_origin, local_origin in WebExtractor.origins.items():
+            if origin == local_origin:
+                return live_origin + url.removeprefix(origin)
+        return url
+
+    @staticmethod
+    def record_page(url: str, final_url: str, html_page: bytes, content_type: str | None = None):
+        if WebExtractor.recorder is None:
+            return
+        WebExtractor.recorder.add_page(final_url, html_page, content_type)
+        WebExtractor.recorder.add_redirect(url, final_url)
+
+    @staticmethod
+    def get_session() -> requests.Session:
+        # Sessions keep connections alive between requests, but are not safe to share between threads
+        session = getattr(WebExtractor.sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = 'Mozilla/5.0'
+            WebExtractor.sessions.session = session
+        return session
+
+    @staticmethod
+    def add_redirects(redirects: dict[str, str]):
+        with WebExtractor.redirects_lock:
+            new_redirects = {url: final for url, final in redirects.items()
+                             if WebExtractor.redirects.get(url) != final}
+            WebExtractor.redirects |= new_redirects
+
+        if len(new_redirects) > 0 and WebExtractor.cache is not None:
+            WebExtractor.cache.add_redirects(new_redirects)
+
+    @staticmethod
+    def map_ordered(submit: Callable[..., Future], items, window: int) -> Iterator[tuple]:
+        # Items are submitted as they are read, so a stage can start on the first results of the stage before it while
+        # that one is still running. At most window items are in flight, and each item is yielded with its result in
+        # the same order as items, regardless of which worker finishes first.
+        pending = deque()
+        for item in items:
+            pending.append((item, submit(item)))
+            while len(pending) >= window or (len(pending) > 0 and pending[0][1].done()):
+                item, future = pending.popleft()
+                yield item, future.result()
+        while len(pending) > 0:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+    def imap(self, func, items) -> Iterator:
+        if WebExtractor.jobs <= 1:
+            for item in items:
+                yield func(item)
+            return
+
+        with ThreadPoolExecutor(max_workers=WebExtractor.jobs) as executor:
+            for _, result in WebExtractor.map_ordered(lambda item: executor.submit(func, item), items,
+                                                      WebExtractor.jobs * 2):
+                yield result
+
+    def parse_imap(self, func, items, get_page) -> Iterator[tuple]:
+        # Calls func(html_page, parser) with the page of each item, and yields every item with its result in the same
+        # order as items. Items without a page get None. With more than one parse job the pages are parsed in worker
+        # processes, so parsing uses several cores while the fetch threads keep downloading, and func must be a
+        # module-level function that only takes and returns plain data.
+        parser = WebExtractor.get_parser()
+        if WebExtractor.parse_jobs <= 1:
+            for item in items:
+                html_page = get_page(item)
+                if html_page is None:
+                    yield item, None
+                    continue
+                with Profiler.stage('parse'):
+                    Profiler.count('parse.bytes', len(html_page))
+                    result = func(html_page, parser)
+                yield item, result
+            return
+
+        pool = WebExtractor.get_parse_pool()
+
+        def submit(item) -> Future:
+            html_page = get_page(item)
+            if html_page is None:
+                future = Future()
+                future.set_result(None)
+                return future
+            Profiler.count('parse.bytes', len(html_page))
+            return pool.submit(func, html_page, parser)
+
+        yield from WebExtractor.map_ordered(submit, items, WebExtractor.parse_jobs * 2)
+
+    def map(self, func, items) -> list:
+        return list(self.imap(func, items))
+
+    def get_soups(self, paths) -> list:
+        return self.map(self.get_soup, paths)
+
+    def find_final_paths(self, paths) -> list[str]:
+        if self.uses_api():
+            urls = [urllib.parse.urljoin(self.base_url, path).split('#')[0] for path in paths]
+            self.resolve_titles([url for url in urls if url not in WebExtractor.redirects])
+        return self.map(self.find_final_path, paths)
+
+    def resolve_redirects(self, items, get_paths) -> Iterator:
+        # With the API, the redirects of the paths of several items are looked up in a single query before the items
+        # are passed on, so finding their final paths afterwards does not need a request each
+        if not self.uses_api():
+            yield from items
+            return
+
+        batch = []
+        paths = []
+        for item in items:
+            batch.append(item)
+            paths.extend(get_paths(item))
+            if len(paths) >= API_TITLES_PER_QUERY:
+                self.find_final_paths(paths)
+                yield from batch
+                batch = []
+                paths = []
+        if len(paths) > 0:
+            self.find_final_paths(paths)
+        yield from batch
+
+    def get_page(self, url) -> bytes | None:
+        with Profiler.stage('get_page'):
+            return self.load_page(url)
+
+    def load_page(self, url) -> bytes | None:
+        cache = WebExtractor.cache
+        entry = None
+        if cache is not None:
+            entry = cache.get(url)
+            if entry is not None and (WebExtractor.offline or cache.is_fresh(entry)):
+                html_page = cache.read_body(entry)
+                if html_page is not None:
+                    Logger.log_debug('Using cached response for URL "%s"', url, color='cyan')
+                    Profiler.count('cache.hits')
+                    WebExtractor.add_redirects({url: entry.url, entry.url: entry.url})
+                    WebExtractor.record_page(url, entry.url, html_page)
+                    return html_page
+
+        if cache is not None:
+            Profiler.count('cache.misses')
+        if WebExtractor.offline:
+            Logger.log_info('Failed to load URL "%s": not in cache', url, color='red')
+            return None
+
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        if entry is not None:
+            headers |= ResponseCache.get_validators(entry)
 
         try:
-            req = Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-            html_page = urlopen(req).read()
+            Profiler.count('http.requests')
+            req = Request(WebExtractor.to_transport(url), headers=headers)
+            response = urlopen(req)
+            html_page = response.read()
+            Profiler.count('http.bytes', len(html_page))
         except HTTPError as e:
-            print(colored(f'Failed to load URL "{url}": {e}', 'red'))
+            if e.code == 304 and entry is not None:
+                html_page = cache.read_body(entry)
+                if html_page is not None:
+                    Logger.log_debug('Cached response for URL "%s" is still valid', url, color='cyan')
+                    Profiler.count('cache.revalidated')
+                    cache.touch(url, entry)
+                    WebExtractor.add_redirects({url: entry.url, entry.url: entry.url})
+                    WebExtractor.record_page(url, entry.url, html_page)
+                    return html_page
+            Logger.log_info('Failed to load URL "%s": %s', url, e, color='red')
             return None
 
-        return BeautifulSoup(html_page, 'html.parser')
+        # urlopen follows redirects, so the page we got back is already the end of the chain
+        final_url = WebExtractor.from_transport(response.geturl().split('#')[0])
+        WebExtractor.add_redirects({url: final_url, final_url: final_url})
+        WebExtractor.record_page(url, final_url, html_page, response.headers.get('Content-Type'))
+
+        if cache is not None:
+            cache.put(url, final_url, response.status, html_page, response.headers)
+
+        return html_page
+
+    def get_html(self, path) -> bytes | None:
+        url = urllib.parse.urljoin(self.base_url, path)
+        Logger.log_debug('Loading URL "%s"', url, color='cyan')
+        return self.get_page(url)
+
+    def parse(self, html_page, parse_only: SoupStrainer | None = None):
+        if parse_only is None:
+            parse_only = self.parse_only
+
+        with Profiler.stage('parse'):
+            Profiler.count('parse.bytes', len(html_page))
+            return WebExtractor.parse_html(html_page, WebExtractor.get_parser(), parse_only)
+
+    @staticmethod
+    def parse_html(html_page, parser: str, parse_only: SoupStrainer | None = None):
+        soup = BeautifulSoup(html_page, parser, parse_only=parse_only)
+        if parse_only is not None and soup.find() is None:
+            # The page does not have the expected layout, so look at all of it instead
+            Logger.log_debug('Nothing matched the parse filter, parsing the whole page', color='yellow')
+            soup = BeautifulSoup(html_page, parser)
+        return soup
+
+    def get_soup(self, path, parse_only: SoupStrainer | None = None):
+        with Profiler.stage('get_soup'):
+            html_page = self.get_html(path)
+            if html_page is None:
+                return None
+
+            return self.parse(html_page, parse_only)
+
+    def get_redirect(self, url) -> str | None:
+        # HEAD is enough to read the Location header, there is no need to download the page body
+        Profiler.count('http.head_requests')
+        transport_url = WebExtractor.to_transport(url)
+        response = WebExtractor.get_session().head(transport_url, allow_redirects=False)
+        if response.status_code in (301, 302):
+            return WebExtractor.from_transport(urllib.parse.urljoin(transport_url, response.headers['Location']))
+        return None
 
     def find_final_path(self, path) -> str:
+        with Profiler.stage('find_final_path'):
+            return self.follow_redirects(path)
+
+    def follow_redirects(self, path) -> str:
         redirect_end = False
-        next_loc = urllib.parse.urljoin(self.base_url, path)
-        Logger.log_debug(colored(f'Finding redirects for URL "{next_loc}"', 'cyan'))
+        start_url = next_loc = urllib.parse.urljoin(self.base_url, path).split('#')[0]
+        Logger.log_debug('Finding redirects for URL "%s"', next_loc, color='cyan')
 
+        chain = []
         while not redirect_end:
-            response = requests.get(next_loc, allow_redirects=False)
-            if response.status_code in (301, 302):
-                location = response.headers['Location']
-                next_loc = location
+            final = WebExtractor.redirects.get(next_loc)
+            if final is not None:
+                Profiler.count('redirects.memo_hits')
+                next_loc = final
+                break
+
+            if WebExtractor.offline:
+                Logger.log_verbose('No cached redirect for URL "%s", assuming it is final', next_loc, color='yellow')
+                break
+
+            chain.append(next_loc)
+            location = self.get_redirect(next_loc)
+            if location is not None:
+                # remove fragment from URL
+                next_loc = location.split('#')[0]
+                if next_loc in chain:
+                    Logger.log_info('Redirect loop detected for URL "%s"', next_loc, color='red')
+                    break
             else:
                 redirect_end = True
 
-        # remove fragment from URL
-        next_loc = next_loc.split('#')[0]
-        Logger.log_debug(colored(f'URL redirects to "{next_loc}"', 'cyan'))
+        WebExtractor.add_redirects({url: next_loc for url in chain})
+        if WebExtractor.recorder is not None:
+            WebExtractor.recorder.add_redirect(start_url, next_loc)
+        Logger.log_debug('URL redirects to "%s"', next_loc, color='cyan')
         return next_loc
+
+    @staticmethod
+    def get_revision(html_page) -> int | None:
+        # MediaWiki exposes the revision of the page being viewed in its inline config script
+        if html_page is None:
+            return None
+        match = re.search(rb'"wgRevisionId":\s*(\d+)', html_page)
+        if match is None:
+            return None
+        return int(match.group(1))
+
+    def get_title(self, url) -> str | None:
+        path = urllib.parse.urlparse(url).path
+        if not path.startswith(self.article_path):
+            return None
+        return urllib.parse.unquote(path.removeprefix(self.article_path)).replace('_', ' ')
+
+    def get_url(self, title: str) -> str:
+        path = urllib.parse.quote(title.replace(' ', '_'), safe=TITLE_SAFE_CHARS)
+        return urllib.parse.urljoin(self.base_url, self.article_path + path)
+
+    def uses_api(self) -> bool:
+        return WebExtractor.use_api and self.api_path is not None and not WebExtractor.offline
+
+    def get_titles(self, urls) -> dict[str, list[str]]:
+        titles = {}
+        for url in urls:
+            title = self.get_title(url)
+            if title is not None and urllib.parse.urlparse(url).query == '':
+                titles.setdefault(title, []).append(url)
+        return titles
+
+    def query_api(self, params: dict) -> dict | None:
+        api_url = urllib.parse.urljoin(self.base_url, self.api_path)
+        try:
+            Profiler.count('api.requests')
+            response = WebExtractor.get_session().get(WebExtractor.to_transport(api_url), params=params)
+            response.raise_for_status()
+            if WebExtractor.recorder is not None:
+                WebExtractor.recorder.add_page(WebExtractor.from_transport(response.url), response.content,
+                                               response.headers.get('Content-Type'))
+            return response.json()['query']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            Logger.log_info('Failed to query "%s": %s', api_url, e, color='red')
+            return None
+
+    def query_titles(self, titles: list[str], redirects: bool = False) -> dict[str, tuple[str, int | None]]:
+        # Returns the title each title ends up at, after normalisation and, if redirects is set, following redirects,
+        # with the revision of that page
+        results = {}
+        for i in range(0, len(titles), API_TITLES_PER_QUERY):
+            batch = titles[i:i + API_TITLES_PER_QUERY]
+            Logger.log_debug('Loading revisions for %d pages', len(batch), color='cyan')
+            params = {'action': 'query', 'prop': 'revisions', 'rvprop': 'ids'}
+            if redirects:
+                params['redirects'] = '1'
+            query = self.query_api(params | {'titles': '|'.join(batch), 'format': 'json'})
+            if query is None:
+                continue
+
+            normalized = {n['from']: n['to'] for n in query.get('normalized', [])}
+            redirected = {r['from']: r['to'] for r in query.get('redirects', [])}
+            page_revisions = {page['title']: page['revisions'][0]['revid']
+                              for page in query.get('pages', {}).values() if 'revisions' in page}
+            for title in batch:
+                final = normalized.get(title, title)
+                chain = [final]
+                while final in redirected and redirected[final] not in chain:
+                    final = redirected[final]
+                    chain.append(final)
+                results[title] = (final, page_revisions.get(final))
+
+        return results
+
+    def resolve_titles(self, urls):
+        titles = self.get_titles(urls)
+        if len(titles) == 0:
+            return
+
+        redirects = {}
+        revisions = {}
+        for title, (final, revision) in self.query_titles(list(titles), redirects=True).items():
+            for url in titles[title]:
+                # A page that is neither normalised nor a redirect keeps its URL, as it would when following it
+                final_url = url if final == title else self.get_url(final)
+                redirects[url] = final_url
+                redirects[final_url] = final_url
+                if WebExtractor.recorder is not None:
+                    WebExtractor.recorder.add_redirect(url, final_url)
+                if revision is not None:
+                    revisions[url] = revision
+                    revisions[final_url] = revision
+
+        WebExtractor.add_redirects(redirects)
+        with WebExtractor.redirects_lock:
+            WebExtractor.revisions |= revisions
+
+    def get_revisions(self, urls) -> dict[str, int]:
+        if self.api_path is None or WebExtractor.offline:
+            return {}
+
+        if self.uses_api():
+            self.resolve_titles([url for url in urls if url not in WebExtractor.revisions])
+            return {url: WebExtractor.revisions[url] for url in urls if url in WebExtractor.revisions}
+
+        titles = self.get_titles(urls)
+        revisions = {}
+        for title, (_, revision) in self.query_titles(list(titles)).items():
+            if revision is not None:
+                for url in titles[title]:
+                    revisions[url] = revision
+        return revisions
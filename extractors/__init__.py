@@ -12,6 +12,54 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-__all__ = [
-    'rdr'
-]
+
+import importlib
+import pkgutil
+from collections.abc import Iterator, Mapping
+
+# Extractors installed by other packages register an entry point in this group, named after the extractor
+ENTRY_POINT_GROUP = 'missiontreegen.extractors'
+
+
+# Extractor names to their classes, imported only when an extractor is looked up. Each module in this package is an
+# extractor named after the module, whose class is the capitalised module name (rdr.Rdr), except private modules
+# starting with an underscore, which can hold helpers shared between extractors. Entry points are only read
+# when a name is not one of the built-in extractors, or when every extractor is listed.
+class ExtractorRegistry(Mapping):
+    def __init__(self):
+        self.modules = {module.name: f'{__name__}.{module.name}' for module in pkgutil.iter_modules(__path__)
+                        if not module.name.startswith('_')}
+        self.entry_points = None
+        self.classes = {}
+
+    def get_entry_points(self) -> dict:
+        if self.entry_points is None:
+            from importlib.metadata import entry_points
+            self.entry_points = {entry_point.name: entry_point for entry_point in entry_points(group=ENTRY_POINT_GROUP)
+                                 if entry_point.name not in self.modules}
+        return self.entry_points
+
+    def __getitem__(self, name: str):
+        extractor_class = self.classes.get(name)
+        if extractor_class is not None:
+            return extractor_class
+
+        if name in self.modules:
+            extractor_class = getattr(importlib.import_module(self.modules[name]), name.capitalize())
+        else:
+            extractor_class = self.get_entry_points()[name].load()
+        self.classes[name] = extractor_class
+        return extractor_class
+
+    def __contains__(self, name) -> bool:
+        return name in self.modules or name in self.get_entry_points()
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.modules
+        yield from self.get_entry_points()
+
+    def __len__(self) -> int:
+        return len(self.modules) + len(self.get_entry_points())
+
+
+EXTRACTORS = ExtractorRegistry()
@@ -12,17 +12,40 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from termcolor import colored
+import re
+from collections.abc import Iterator
+
+from bs4 import SoupStrainer
 
 from common import Mission, Part
 from extractor import Extractor, WebExtractor
 from logger import Logger
+from profiler import Profiler
+
+# Everything the extractor reads (the mission lists, infobox and prerequisites) is inside the article content
+PARSE_ONLY = SoupStrainer(class_=re.compile(r'(^|\s)mw-parser-output(\s|$)'))
+
+
+def parse_mission(html_page: bytes, parser: str) -> dict:
+    # Runs in a parse worker process, so it returns the prerequisite links as they are on the page, and they are
+    # followed to their final paths back in the fetch threads
+    soup = WebExtractor.parse_html(html_page, parser, PARSE_ONLY)
+    record = {
+        'giver': Rdr.get_mission_given_by(soup),
+        'location': Rdr.get_mission_location(soup),
+        'depends': Rdr.get_depend_links(soup),
+        'revision': WebExtractor.get_revision(html_page),
+    }
+    # Decomposing breaks the references between the elements, so the tree is freed now instead of by the garbage
+    # collector
+    soup.decompose()
+    return record
 
 
 class Rdr(Extractor):
     def __init__(self):
         self.missions = None
-        self.web_extractor = WebExtractor('https://reddead.fandom.com')
+        self.web_extractor = WebExtractor('https://reddead.fandom.com', api_path='/api.php', parse_only=PARSE_ONLY)
 
     def get_description(self) -> str:
         return 'Red Dead Redemption'
@@ -36,87 +59,129 @@ class Rdr(Extractor):
             return None
 
         h2 = soup.select_one('h2 #Single_Player').find_parent('h2')
-        Logger.log_trace(f'h2 = {h2}')
+        Logger.log_trace('h2 = %s', h2)
         parts = []
+        # Only the title and path of each mission link are kept, so the page can be released straight away
         missions = {}
 
         for sibling in h2.find_next_siblings():
-            Logger.log_trace(f'sibling = {sibling}')
+            Logger.log_trace('sibling = %s', sibling)
             if sibling.name == 'h2':
                 Logger.log_trace('Found another h2, exiting loop')
                 break
 
             if sibling.name == 'h3':
                 part_name = sibling.find_next('span').text
-                Logger.log_trace(f'Found part "{part_name}"')
+                Logger.log_trace('Found part "%s"', part_name)
                 missions[part_name] = []
                 parts.append(Part(part_name))
             else:
                 if len(list(missions)) < 1:
                     continue
-                Logger.log_trace(f'Appending "{sibling} to list "{list(missions)[-1]}"')
-                missions[list(missions)[-1]].append(sibling)
+                Logger.log_trace(lambda: f'Appending "{sibling} to list "{list(missions)[-1]}"')
+                missions[list(missions)[-1]].extend(self.get_links(sibling))
 
+        soup.decompose()
         self.missions = missions
         return parts
 
-    def get_missions(self, part_title) -> list[Mission]:
-        missions = self.missions[part_title]
-        missions_obj = []
-        for mission in missions:
-            for li in mission.find_all('li'):
-                mission_name = li.select_one('a')['title']
-                Logger.log_trace(f'li = {li}')
-                Logger.log_trace(f'Found mission "{mission_name}"')
-
-                mission_path = li.select_one('a')['href']
-                mission_path = self.web_extractor.find_final_path(mission_path)
-
-                mission_soup = self.web_extractor.get_soup(mission_path)
-
-                tags = []
-                giver = self.get_mission_given_by(mission_soup)
-                if giver is not None:
-                    tags.append(f'giver.{giver}')
-                location = self.get_mission_location(mission_soup)
-                if location is not None:
-                    tags.append(f'location.{location}')
-
-                depends = self.get_depends(mission_soup)
-                if len(depends) < 1:
-                    Logger.log_info("Mission {} {}".format(mission_name, colored('has no dependencies', 'red')))
-                else:
-                    Logger.log_verbose(
-                        "Mission {} {}".format(mission_name, colored(f'has {len(depends)} dependencies:', 'green')))
-                    for depend in depends:
-                        Logger.log_debug("\t{}".format(depend))
-                missions_obj.append(Mission(mission_name, mission_path, depends, tags))
-
-        return missions_obj
-
-    def get_mission_given_by(self, soup):
+    @staticmethod
+    def get_links(element) -> list[tuple[str, str]]:
+        links = []
+        for li in element.find_all('li'):
+            Logger.log_trace('li = %s', li)
+            a = li.select_one('a')
+            links.append((a['title'], a['href']))
+        return links
+
+    def get_missions(self, part_title) -> Iterator[Mission]:
+        with Profiler.stage('Rdr.get_missions'):
+            # The links of a part are not needed again once its missions have been extracted
+            links = self.missions.pop(part_title)
+
+            revisions = {}
+            if len(self.previous_missions) > 0 or self.web_extractor.uses_api():
+                paths = self.web_extractor.find_final_paths([path for _, path in links])
+                links = [(name, path) for (name, _), path in zip(links, paths)]
+                if len(self.previous_missions) > 0:
+                    revisions = self.web_extractor.get_revisions(paths)
+
+            # Pages are fetched in the fetch threads, parsed in the parse workers, and turned back into missions in the
+            # fetch threads, with each stage working on the first missions while the one before it is still running
+            pages = self.web_extractor.imap(lambda link: self.fetch_mission(link, revisions), links)
+            records = self.web_extractor.parse_imap(parse_mission, pages, lambda page: page[3])
+            # Pages are dropped as soon as they are parsed, so only the records wait for the next stage
+            records = ((page[:3], record) for page, record in records)
+            records = self.web_extractor.resolve_redirects(records, lambda parsed: parsed[1]['depends']
+                                                           if parsed[1] is not None else [])
+            yield from self.web_extractor.imap(self.build_mission, records)
+
+    def fetch_mission(self, link, revisions) -> tuple:
+        mission_name, mission_path = link
+        Logger.log_trace('Found mission "%s"', mission_name)
+
+        mission_path = self.web_extractor.find_final_path(mission_path)
+
+        previous = self.previous_missions.get(mission_path)
+        if previous is not None and previous.revision is not None \
+                and previous.revision == revisions.get(mission_path):
+            Logger.log_verbose('Mission %s is unchanged', mission_name, color='green')
+            Profiler.count('missions.unchanged')
+            return mission_name, mission_path, previous, None
+
+        return mission_name, mission_path, None, self.web_extractor.get_html(mission_path)
+
+    def build_mission(self, parsed) -> Mission:
+        (mission_name, mission_path, previous), record = parsed
+        if previous is not None:
+            return previous
+
+        tags = []
+        depends = []
+        revision = None
+        if record is not None:
+            if record['giver'] is not None:
+                tags.append(f'giver.{record["giver"]}')
+            if record['location'] is not None:
+                tags.append(f'location.{record["location"]}')
+            depends = [Mission.sanitize_string(self.web_extractor.find_final_path(path)) for path in record['depends']]
+            revision = record['revision']
+
+        if len(depends) < 1:
+            Logger.log_info('Mission %s has no dependencies', mission_name, color='red')
+        else:
+            Logger.log_verbose('Mission %s has %d dependencies:', mission_name, len(depends), color='green')
+            if Logger.is_enabled(Logger.DEBUG):
+                for depend in depends:
+                    Logger.log_debug('\t%s', depend)
+        return Mission(mission_name, mission_path, depends, tags, revision)
+
+    @staticmethod
+    def get_mission_given_by(soup):
         giver = soup.find('div', {'data-source': 'giver'})
-        Logger.log_trace(f'giver = {giver}')
+        Logger.log_trace('giver = %s', giver)
         if giver is not None:
             giver_name = giver.find('a').text
-            Logger.log_trace(f'giver_name = {giver_name}')
+            Logger.log_trace('giver_name = %s', giver_name)
             return Mission.sanitize_string(giver_name)
         return None
 
-    def get_mission_location(self, soup):
+    @staticmethod
+    def get_mission_location(soup):
         location = soup.find('div', {'data-source': 'location'})
-        Logger.log_trace(f'location = {location}')
+        Logger.log_trace('location = %s', location)
         if location is not None:
             a = location.find('a')
             if a is not None:
                 location_name = a.text
-                Logger.log_trace(f'location_name = {location_name}')
+                Logger.log_trace('location_name = %s', location_name)
                 return Mission.sanitize_string(location_name)
         return None
 
-    def get_depends(self, soup):
+    @staticmethod
+    def get_depend_links(soup) -> list[str]:
         h3 = soup.select_one('h3 #Mission_Prerequisites')
-        Logger.log_trace(f'h3 = {h3}')
+        Logger.log_trace('h3 = %s', h3)
 
         if h3 is None:
             return []
@@ -131,22 +196,20 @@ class Rdr(Extractor):
                 break
 
             if sibling.name == 'ul':
-                Logger.log_trace(f'ul = {sibling}')
+                Logger.log_trace('ul = %s', sibling)
                 ul = sibling
 
             if sibling.name == 'p':
-                Logger.log_trace(f'p = {sibling}')
+                Logger.log_trace('p = %s', sibling)
                 p = sibling
 
         if ul is None and p is not None:
             # Check for note saying the mission starts automatically
             if 'automatically' in p.text or 'following' in p.text:
                 a = p.find_next('a')
-                Logger.log_trace(f'a = {a}')
+                Logger.log_trace('a = %s', a)
                 if a is not None:
-                    path = a['href']
-                    path = self.web_extractor.find_final_path(path)
-                    return [Mission.sanitize_string(path)]
+                    return [a['href']]
             return []
 
         for li in ul.select('li'):
@@ -154,10 +217,8 @@ class Rdr(Extractor):
                 continue
 
             links = li.select('a')
-            Logger.log_trace(f'links = {links}')
+            Logger.log_trace('links = %s', links)
             if len(links) > 0:
-                path = links[-1]['href']
-                path = self.web_extractor.find_final_path(path)
-                depends.append(Mission.sanitize_string(path))
+                depends.append(links[-1]['href'])
 
         return depends
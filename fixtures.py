@@ -0,0 +1,167 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import json
+import os
+import threading
+import urllib.parse
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import ResponseCache
+from logger import Logger
+
+
+@dataclass
+class FixtureRecord:
+    url: str
+    status: int
+    location: str | None = None
+    content_type: str | None = None
+    body: str | None = None
+
+
+def get_origin(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+# Every response an extraction received, so it can be replayed without the network. Each response is a line in
+# responses.jsonl, and bodies are stored once under bodies/, named by the SHA-256 of their content. Redirects are kept
+# as a response pointing at the final URL, so a chain of redirects is replayed as a single one.
+class FixtureArchive:
+    def __init__(self, path: str):
+        self.path = path
+        self.bodies_dir = os.path.join(path, 'bodies')
+        self.responses_path = os.path.join(path, 'responses.jsonl')
+        self.lock = threading.Lock()
+        self.recorded: dict[str, FixtureRecord] = {}
+
+        os.makedirs(self.bodies_dir, exist_ok=True)
+
+    def add(self, record: FixtureRecord, body: bytes | None = None):
+        if body is not None:
+            record.body = hashlib.sha256(body).hexdigest()
+            body_path = os.path.join(self.bodies_dir, record.body)
+            if not os.path.exists(body_path):
+                ResponseCache.write_atomic(body_path, body)
+
+        with self.lock:
+            # A response without a body never replaces one with a body, which has more to replay
+            previous = self.recorded.get(record.url)
+            if previous == record or (previous is not None and record.body is None and record.location is None):
+                return
+            self.recorded[record.url] = record
+            with open(self.responses_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record.__dict__) + '\n')
+
+    def add_page(self, url: str, body: bytes, content_type: str | None = None):
+        self.add(FixtureRecord(url, 200, content_type=content_type), body)
+
+    def add_redirect(self, url: str, final_url: str):
+        if url == final_url:
+            self.add(FixtureRecord(url, 200))
+        else:
+            self.add(FixtureRecord(url, 301, location=final_url))
+
+    def load(self) -> dict[str, FixtureRecord]:
+        records = {}
+        try:
+            with open(self.responses_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = FixtureRecord(**json.loads(line))
+                    except (ValueError, TypeError):
+                        # A partially written line from an interrupted recording
+                        continue
+                    previous = records.get(record.url)
+                    if previous is None or record.body is not None or record.location is not None:
+                        records[record.url] = record
+        except OSError:
+            pass
+        return records
+
+    def read_body(self, record: FixtureRecord) -> bytes:
+        if record.body is None:
+            return b''
+        with open(os.path.join(self.bodies_dir, record.body), 'rb') as f:
+            return f.read()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    server: 'ReplayServer'
+
+    def do_GET(self):
+        self.reply(True)
+
+    def do_HEAD(self):
+        self.reply(False)
+
+    def reply(self, send_body: bool):
+        record = self.server.records.get(self.server.origin + self.path)
+        if record is None:
+            self.send_error(404)
+            return
+
+        if record.location is not None:
+            self.send_response(record.status)
+            # Redirects to the recorded origin are followed on this server
+            self.send_header('Location', self.server.to_local(record.location))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = self.server.archive.read_body(record)
+        self.send_response(record.status)
+        self.send_header('Content-Type', record.content_type or 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        Logger.log_debug('Replay server: ' + format, *args)
+
+
+# Serves the responses of an archive that were recorded from one origin, as a local stand-in for the real site
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, archive: FixtureArchive, origin: str | None = None, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), ReplayHandler)
+        self.archive = archive
+        self.records = archive.load()
+        if origin is None and len(self.records) > 0:
+            origin = get_origin(next(iter(self.records)))
+        self.origin = origin
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def to_local(self, url: str) -> str:
+        if get_origin(url) == self.origin:
+            return self.url + url.removeprefix(self.origin)
+        return url
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
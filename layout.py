@@ -0,0 +1,67 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import json
+
+from logger import Logger
+
+# Graphviz reports positions in points, but reads them back in inches
+POINTS_PER_INCH = 72
+
+
+# Node positions from a previous render. Each position is stored with a signature of the mission it was computed for, so
+# that only missions that have not changed are pinned to where they were.
+class Layout:
+    def __init__(self, path: str | None = None):
+        self.nodes: dict[str, dict] = {}
+        self.signatures: dict[str, str] = {}
+        self.pinned = 0
+
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.nodes = json.load(f)['nodes']
+            except (OSError, ValueError, KeyError) as e:
+                Logger.log_info('Failed to load layout "%s", laying out every node: %s', path, e, color='yellow')
+
+    @staticmethod
+    def get_signature(mission: dict) -> str:
+        data = json.dumps([mission['title'], mission['tags'], mission['depends_on']], ensure_ascii=False)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get_pin(self, mission: dict) -> str | None:
+        signature = Layout.get_signature(mission)
+        self.signatures[mission['id']] = signature
+
+        node = self.nodes.get(mission['id'])
+        if node is None or node['signature'] != signature:
+            return None
+
+        self.pinned += 1
+        x, y = node['pos']
+        # The exclamation mark stops the engine from moving the node
+        return f'{x / POINTS_PER_INCH:.4f},{y / POINTS_PER_INCH:.4f}!'
+
+    def save(self, path: str, graph: dict):
+        nodes = {}
+        for obj in graph.get('objects', []):
+            if 'nodes' in obj or 'pos' not in obj or obj['name'] not in self.signatures:
+                continue
+            x, y = obj['pos'].split(',')[:2]
+            nodes[obj['name']] = {'pos': [float(x), float(y)], 'signature': self.signatures[obj['name']]}
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'nodes': nodes}, f, ensure_ascii=False)
+        Logger.log_verbose('Saved the positions of %d nodes to %s', len(nodes), path)
@@ -12,28 +12,82 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+
+import sys
+import threading
+from typing import TextIO
+
+from termcolor import colored
+
+
+# Messages are only formatted once their level is known to be enabled. A message is either a string with %-style
+# arguments, or a callable that returns the string, so building it costs nothing when it is not logged.
 class Logger:
-    level: int
+    INFO = 0
+    VERBOSE = 1
+    DEBUG = 2
+    TRACE = 3
+
+    level: int = INFO
+    # None writes to whatever sys.stdout is at the time
+    sink: TextIO | None = None
+    colors: bool = True
+    lock = threading.Lock()
 
     @staticmethod
     def set_level(level: int):
         Logger.level = level
 
     @staticmethod
-    def log_info(*args):
-        print(*args)
+    def set_sink(sink: TextIO | None):
+        Logger.sink = sink
+        # Colors are only kept when writing to a terminal
+        Logger.colors = sink is None or sink.isatty()
+
+    @staticmethod
+    def open_sink(path: str):
+        Logger.set_sink(open(path, 'w', encoding='utf-8', buffering=1024 * 1024))
+
+    @staticmethod
+    def close_sink():
+        if Logger.sink is not None:
+            Logger.sink.close()
+            Logger.set_sink(None)
+
+    @staticmethod
+    def is_enabled(level: int) -> bool:
+        return Logger.level >= level
+
+    @staticmethod
+    def log(level: int, message, *args, color: str | None = None):
+        if Logger.level < level:
+            return
+
+        if callable(message):
+            message = message()
+        elif len(args) > 0:
+            message = message % args
+        if color is not None and Logger.colors:
+            message = colored(message, color)
+
+        with Logger.lock:
+            (Logger.sink or sys.stdout).write(f'{message}\n')
+
+    @staticmethod
+    def log_info(message, *args, color: str | None = None):
+        Logger.log(Logger.INFO, message, *args, color=color)
 
     @staticmethod
-    def log_verbose(*args):
-        if Logger.level >= 1:
-            print(*args)
+    def log_verbose(message, *args, color: str | None = None):
+        if Logger.level >= Logger.VERBOSE:
+            Logger.log(Logger.VERBOSE, message, *args, color=color)
 
     @staticmethod
-    def log_debug(*args):
-        if Logger.level >= 2:
-            print(*args)
+    def log_debug(message, *args, color: str | None = None):
+        if Logger.level >= Logger.DEBUG:
+            Logger.log(Logger.DEBUG, message, *args, color=color)
 
     @staticmethod
-    def log_trace(*args):
-        if Logger.level >= 3:
-            print(*args)
+    def log_trace(message, *args, color: str | None = None):
+        if Logger.level >= Logger.TRACE:
+            Logger.log(Logger.TRACE, message, *args, color=color)
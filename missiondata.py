@@ -0,0 +1,167 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import itertools
+import json
+import re
+from collections.abc import Iterator
+
+import missionstore
+from common import EnhancedJSONEncoder, Mission
+
+FORMATS = ['json', 'ndjson', 'sqlite']
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+NDJSON_START = re.compile(rb'\s*\{\s*"type"\s*:')
+FORMAT_SNIFF_SIZE = 64
+
+
+class JsonWriter:
+    def __init__(self, path: str, compact: bool = False):
+        self.path = path
+        self.compact = compact
+        self.data = {'parts': []}
+
+    def add_part(self, title: str):
+        self.data['parts'].append({'title': title, 'missions': []})
+
+    def add_mission(self, mission: Mission):
+        self.data['parts'][-1]['missions'].append(mission)
+
+    def close(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            if self.compact:
+                json.dump(self.data, f, ensure_ascii=False, separators=(',', ':'), cls=EnhancedJSONEncoder)
+            else:
+                json.dump(self.data, f, ensure_ascii=False, indent=4, cls=EnhancedJSONEncoder)
+
+
+# Writes one record per line as soon as it is produced, so the file can be read while extraction is still running. A
+# part record is followed by the records of all of its missions.
+class NdjsonWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.part_title = None
+
+    def write_record(self, record: dict):
+        self.file.write(json.dumps(record, ensure_ascii=False, cls=EnhancedJSONEncoder) + '\n')
+        self.file.flush()
+
+    def add_part(self, title: str):
+        self.part_title = title
+        self.write_record({'type': 'part', 'title': title})
+
+    def add_mission(self, mission: Mission):
+        self.write_record({'type': 'mission', 'part': self.part_title} | mission.to_dict())
+
+    def close(self):
+        self.file.close()
+
+
+def get_output_format(path: str, output_format: str | None = None) -> str:
+    if output_format is not None:
+        return output_format
+    if path.endswith('.ndjson') or path.endswith('.jsonl'):
+        return 'ndjson'
+    if path.endswith('.db') or path.endswith('.sqlite') or path.endswith('.sqlite3'):
+        return 'sqlite'
+    return 'json'
+
+
+def make_writer(path: str, output_format: str | None = None, game: str | None = None, compact: bool = False):
+    output_format = get_output_format(path, output_format)
+    if output_format == 'sqlite':
+        return missionstore.SqliteWriter(path, game)
+    if output_format == 'ndjson':
+        return NdjsonWriter(path)
+    return JsonWriter(path, compact)
+
+
+def detect_format(path: str) -> str:
+    # Only the start of the file is read, as a compact JSON document is a single line however large it is. Every ndjson
+    # record starts with its type, and a JSON document starts with its parts.
+    with open(path, 'rb') as f:
+        head = f.read(FORMAT_SNIFF_SIZE)
+    if head.startswith(SQLITE_HEADER):
+        return 'sqlite'
+    if NDJSON_START.match(head):
+        return 'ndjson'
+    return 'json'
+
+
+def read_records(path: str) -> Iterator[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # The last line may still be being written
+                return
+
+
+# With the line-delimited and SQLite formats, the missions of a part are read lazily, so each part must be consumed
+# before moving on to the next. A database can hold several games, and game only needs to be given when it does.
+def read_parts(path: str, game: str | None = None, filters: dict[str, list[str]] | None = None) -> Iterator[dict]:
+    data_format = detect_format(path)
+    if data_format == 'sqlite':
+        return missionstore.read_parts(path, game, filters)
+    if filters:
+        return filter_parts(read_file_parts(path, data_format), filters)
+    return read_file_parts(path, data_format)
+
+
+def read_file_parts(path: str, data_format: str) -> Iterator[dict]:
+    # A JSON document is loaded straight away, so an invalid one is reported before any parts are read
+    if data_format == 'json':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or not isinstance(data.get('parts'), list):
+            raise ValueError('no parts found')
+        return iter(data['parts'])
+    return read_record_parts(path)
+
+
+def read_record_parts(path: str) -> Iterator[dict]:
+    for title, records in itertools.groupby(read_records(path), key=lambda r: r['title'] if r['type'] == 'part'
+                                            else r['part']):
+        yield {'title': title, 'missions': (record for record in records if record['type'] == 'mission')}
+
+
+def filter_parts(parts: Iterator[dict], filters: dict[str, list[str]]) -> Iterator[dict]:
+    # The same filters as the database applies: values of the same field are alternatives, and every field must match
+    values = {field: set(field_values) for field, field_values in filters.items()}
+    selected = []
+    for part in parts:
+        if 'part' in values and part['title'] not in values['part']:
+            continue
+        missions = [mission for mission in part['missions']
+                    if ('id' not in values or mission['id'] in values['id'])
+                    and ('tag' not in values or not values['tag'].isdisjoint(mission['tags']))]
+        if len(missions) > 0:
+            selected.append({'title': part['title'], 'missions': missions})
+
+    # Only keep dependencies between the selected missions
+    ids = {mission['id'] for part in selected for mission in part['missions']}
+    for part in selected:
+        for mission in part['missions']:
+            mission['depends_on'] = [dependency for dependency in mission['depends_on'] if dependency in ids]
+        yield part
+
+
+def read_missions(path: str, game: str | None = None) -> Iterator[dict]:
+    for part in read_parts(path, game):
+        yield from part['missions']
@@ -0,0 +1,299 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import heapq
+from array import array
+from collections.abc import Iterable, Iterator
+
+
+# Compact graph of the missions in a data file. Mission ids are interned to integer nodes, and edges are kept in flat
+# arrays: the dependencies of mission record r are deps[dep_offsets[r]:dep_offsets[r + 1]]. Nodes that are only ever
+# named as a dependency are interned too, but have no mission record.
+class MissionGraph:
+    def __init__(self):
+        self.ids: list[str] = []
+        self.index: dict[str, int] = {}
+        self.part_titles: list[str] = []
+
+        # One entry per mission record, in file order
+        self.mission_parts = array('i')
+        self.mission_nodes = array('i')
+        self.mission_titles: list[str] = []
+        self.mission_tags: list[list[str]] = []
+        self.dep_offsets = array('i', [0])
+        self.deps = array('i')
+
+        # Predecessors and successors of each node, built by build_adjacency
+        self.pred_offsets = None
+        self.preds = None
+        self.succ_offsets = None
+        self.succs = None
+
+    def intern(self, node_id: str) -> int:
+        node = self.index.get(node_id)
+        if node is None:
+            node = len(self.ids)
+            self.index[node_id] = node
+            self.ids.append(node_id)
+        return node
+
+    @staticmethod
+    def from_parts(parts: Iterable[dict]) -> 'MissionGraph':
+        graph = MissionGraph()
+        for part in parts:
+            part_index = len(graph.part_titles)
+            graph.part_titles.append(part['title'])
+            for mission in part['missions']:
+                graph.add_mission(part_index, mission['id'], mission['title'], mission['tags'],
+                                  mission['depends_on'])
+        graph.build_adjacency()
+        return graph
+
+    def add_mission(self, part_index: int, node_id: str, title: str, tags: list[str], depends_on: list[str]):
+        self.mission_parts.append(part_index)
+        self.mission_nodes.append(self.intern(node_id))
+        self.mission_titles.append(title)
+        self.mission_tags.append(tags)
+        self.deps.extend(self.intern(dependency) for dependency in depends_on)
+        self.dep_offsets.append(len(self.deps))
+
+    def get_mission_deps(self, record: int):
+        return self.deps[self.dep_offsets[record]:self.dep_offsets[record + 1]]
+
+    def build_adjacency(self):
+        node_count = len(self.ids)
+        preds = [[] for _ in range(node_count)]
+        succs = [[] for _ in range(node_count)]
+        for record, node in enumerate(self.mission_nodes):
+            for dep in self.get_mission_deps(record):
+                preds[node].append(dep)
+                succs[dep].append(node)
+
+        self.pred_offsets, self.preds = MissionGraph.flatten(preds)
+        self.succ_offsets, self.succs = MissionGraph.flatten(succs)
+
+    @staticmethod
+    def flatten(lists: list[list[int]]) -> tuple[array, array]:
+        offsets = array('i', [0])
+        values = array('i')
+        for values_list in lists:
+            values.extend(values_list)
+            offsets.append(len(values))
+        return offsets, values
+
+    def get_predecessors(self, node: int):
+        return self.preds[self.pred_offsets[node]:self.pred_offsets[node + 1]]
+
+    def get_successors(self, node: int):
+        return self.succs[self.succ_offsets[node]:self.succ_offsets[node + 1]]
+
+    def get_mission_count(self) -> int:
+        return len(self.mission_nodes)
+
+    def get_edge_count(self) -> int:
+        return len(self.deps)
+
+    def find_dangling(self) -> list[tuple[str, str]]:
+        # Dependencies on ids that no mission in the file has
+        is_mission = bytearray(len(self.ids))
+        for node in self.mission_nodes:
+            is_mission[node] = 1
+
+        dangling = []
+        for record, node in enumerate(self.mission_nodes):
+            for dep in self.get_mission_deps(record):
+                if not is_mission[dep]:
+                    dangling.append((self.ids[node], self.ids[dep]))
+        return dangling
+
+    def find_cycles(self) -> list[list[str]]:
+        # Tarjan's strongly connected components algorithm, iterative to avoid hitting the recursion limit
+        node_count = len(self.ids)
+        indexes = array('i', [-1]) * node_count
+        low_links = array('i', [0]) * node_count
+        on_stack = bytearray(node_count)
+        stack = []
+        cycles = []
+        next_index = 0
+
+        for root in range(node_count):
+            if indexes[root] != -1:
+                continue
+
+            work = [(root, 0)]
+            while len(work) > 0:
+                node, child = work.pop()
+                if child == 0:
+                    indexes[node] = low_links[node] = next_index
+                    next_index += 1
+                    stack.append(node)
+                    on_stack[node] = 1
+
+                successors = self.get_successors(node)
+                if child > 0:
+                    low_links[node] = min(low_links[node], low_links[successors[child - 1]])
+
+                while child < len(successors):
+                    successor = successors[child]
+                    if indexes[successor] == -1:
+                        break
+                    if on_stack[successor]:
+                        low_links[node] = min(low_links[node], indexes[successor])
+                    child += 1
+
+                if child < len(successors):
+                    work.append((node, child + 1))
+                    work.append((successors[child], 0))
+                    continue
+
+                if low_links[node] == indexes[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in self.get_successors(node):
+                        cycles.append([self.ids[member] for member in reversed(component)])
+
+        return cycles
+
+    def get_topological_order(self) -> list[int] | None:
+        # Of the nodes that are ready, the one read first comes first, so the order stays close to the input order
+        node_count = len(self.ids)
+        in_degrees = array('i', (self.pred_offsets[node + 1] - self.pred_offsets[node] for node in range(node_count)))
+        ready = [node for node in range(node_count) if in_degrees[node] == 0]
+        order = []
+        while len(ready) > 0:
+            node = heapq.heappop(ready)
+            order.append(node)
+            for successor in self.get_successors(node):
+                in_degrees[successor] -= 1
+                if in_degrees[successor] == 0:
+                    heapq.heappush(ready, successor)
+
+        if len(order) < node_count:
+            return None
+        return order
+
+    def reduce(self) -> int | None:
+        # Transitive reduction: an edge u -> v is dropped when u is already an ancestor of another dependency of v. The
+        # ancestors of v's dependencies are searched for each v, and the search stops at nodes that come before all of
+        # them in topological order, as those cannot lead back to one. Only a visit mark per node is kept, so memory
+        # stays linear in the size of the graph.
+        order = self.get_topological_order()
+        if order is None:
+            return None
+
+        position = array('i', bytes(4 * len(self.ids)))
+        for index, node in enumerate(order):
+            position[node] = index
+        visited = array('i', [-1]) * len(self.ids)
+
+        redundant = set()
+        for record in range(len(self.mission_nodes)):
+            record_deps = set(self.get_mission_deps(record))
+            if len(record_deps) < 2:
+                continue
+
+            lowest = min(position[dep] for dep in record_deps)
+            stack = [pred for dep in record_deps for pred in self.get_predecessors(dep)]
+            while len(stack) > 0:
+                node = stack.pop()
+                if visited[node] == record or position[node] < lowest:
+                    continue
+                visited[node] = record
+                if node in record_deps:
+                    redundant.add((record, node))
+                stack.extend(self.get_predecessors(node))
+
+        deps = array('i')
+        dep_offsets = array('i', [0])
+        for record in range(len(self.mission_nodes)):
+            seen = set()
+            for dep in self.get_mission_deps(record):
+                if dep in seen or (record, dep) in redundant:
+                    continue
+                seen.add(dep)
+                deps.append(dep)
+            dep_offsets.append(len(deps))
+
+        removed = len(self.deps) - len(deps)
+        self.deps = deps
+        self.dep_offsets = dep_offsets
+        self.build_adjacency()
+        return removed
+
+    def find_part(self, title: str) -> int | None:
+        try:
+            return self.part_titles.index(title)
+        except ValueError:
+            return None
+
+    def find_mission(self, name: str) -> int | None:
+        node = self.index.get(name)
+        if node is not None:
+            return node
+
+        name = name.lower()
+        for record, title in enumerate(self.mission_titles):
+            if title.lower() == name:
+                return self.mission_nodes[record]
+        return None
+
+    def get_part_nodes(self, part_index: int) -> set[int]:
+        return {node for record, node in enumerate(self.mission_nodes) if self.mission_parts[record] == part_index}
+
+    def get_closure(self, seeds: set[int], depth: int | None = None) -> set[int]:
+        # Prerequisites and dependents of the seeds up to depth steps away. The two directions are followed separately,
+        # so other dependents of a prerequisite are not included.
+        nodes = set(seeds)
+        for get_neighbours in (self.get_predecessors, self.get_successors):
+            visited = set(seeds)
+            frontier = list(seeds)
+            steps = 0
+            while len(frontier) > 0 and (depth is None or steps < depth):
+                next_frontier = []
+                for node in frontier:
+                    for neighbour in get_neighbours(node):
+                        if neighbour not in visited:
+                            visited.add(neighbour)
+                            next_frontier.append(neighbour)
+                frontier = next_frontier
+                steps += 1
+            nodes |= visited
+        return nodes
+
+    def get_mission(self, record: int, nodes: set[int] | None = None) -> dict:
+        deps = self.get_mission_deps(record)
+        if nodes is not None:
+            deps = [dep for dep in deps if dep in nodes]
+        return {
+            'id': self.ids[self.mission_nodes[record]],
+            'title': self.mission_titles[record],
+            'tags': self.mission_tags[record],
+            'depends_on': [self.ids[dep] for dep in deps],
+        }
+
+    def to_parts(self, nodes: set[int] | None = None) -> Iterator[dict]:
+        # When nodes is given, only those missions and the dependencies between them are included
+        part_missions = [[] for _ in self.part_titles]
+        for record in range(self.get_mission_count()):
+            if nodes is None or self.mission_nodes[record] in nodes:
+                part_missions[self.mission_parts[record]].append(self.get_mission(record, nodes))
+
+        for title, missions in zip(self.part_titles, part_missions):
+            if len(missions) > 0:
+                yield {'title': title, 'missions': missions}
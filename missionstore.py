@@ -0,0 +1,217 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import itertools
+import sqlite3
+from collections.abc import Iterator
+
+from common import Mission
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS parts (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+    title TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS missions (
+    id INTEGER PRIMARY KEY,
+    part_id INTEGER NOT NULL REFERENCES parts (id) ON DELETE CASCADE,
+    mission_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    path TEXT NOT NULL,
+    revision INTEGER
+);
+CREATE TABLE IF NOT EXISTS tags (
+    mission_id INTEGER NOT NULL REFERENCES missions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dependencies (
+    mission_id INTEGER NOT NULL REFERENCES missions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    depends_on TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS parts_game ON parts (game_id);
+CREATE INDEX IF NOT EXISTS missions_part ON missions (part_id);
+CREATE INDEX IF NOT EXISTS missions_mission_id ON missions (mission_id);
+CREATE INDEX IF NOT EXISTS missions_path ON missions (path);
+CREATE INDEX IF NOT EXISTS tags_mission ON tags (mission_id, position);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE INDEX IF NOT EXISTS dependencies_mission ON dependencies (mission_id, position);
+CREATE INDEX IF NOT EXISTS dependencies_depends_on ON dependencies (depends_on);
+'''
+
+# Filter fields and the condition on the missions table (m) and parts table (p) that each one adds
+FILTERS = {
+    'tag': 'm.id IN (SELECT mission_id FROM tags WHERE tag IN ({}))',
+    'part': 'p.title IN ({})',
+    'id': 'm.mission_id IN ({})',
+}
+
+# Rows buffered before they are inserted with a single executemany
+BATCH_SIZE = 1000
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def get_games(connection: sqlite3.Connection) -> list[str]:
+    return [name for name, in connection.execute('SELECT name FROM games ORDER BY name')]
+
+
+def find_game(connection: sqlite3.Connection, game: str | None) -> int:
+    games = get_games(connection)
+    if game is None:
+        if len(games) != 1:
+            raise ValueError(f'the database has several games, choose one of: {", ".join(games)}' if len(games) > 1
+                             else 'the database has no games')
+        game = games[0]
+
+    row = connection.execute('SELECT id FROM games WHERE name = ?', (game,)).fetchone()
+    if row is None:
+        raise ValueError(f'no game named "{game}" in the database, choose one of: {", ".join(games)}')
+    return row[0]
+
+
+# Writes the missions of one game, replacing any that were already stored for it. Everything is written in a single
+# transaction, so an interrupted extraction leaves the previous data in place.
+class SqliteWriter:
+    def __init__(self, path: str, game: str):
+        self.path = path
+        self.connection = connect(path)
+        self.connection.execute('DELETE FROM games WHERE name = ?', (game,))
+        self.game_id = self.connection.execute('INSERT INTO games (name) VALUES (?)', (game,)).lastrowid
+
+        # Missions are given their row ids here, so their tags and dependencies can be inserted in the same batch
+        self.next_mission_row = self.connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM missions').fetchone()[0]
+        self.part_row = None
+        self.missions = []
+        self.tags = []
+        self.dependencies = []
+
+    def add_part(self, title: str):
+        self.flush()
+        self.part_row = self.connection.execute('INSERT INTO parts (game_id, title) VALUES (?, ?)',
+                                                (self.game_id, title)).lastrowid
+
+    def add_mission(self, mission: Mission):
+        row = self.next_mission_row
+        self.next_mission_row += 1
+        self.missions.append((row, self.part_row, mission.id, mission.title, mission.path, mission.revision))
+        self.tags.extend((row, position, tag) for position, tag in enumerate(mission.tags))
+        self.dependencies.extend((row, position, dependency) for position, dependency in enumerate(mission.depends_on))
+
+        if len(self.missions) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.connection.executemany('INSERT INTO missions (id, part_id, mission_id, title, path, revision) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)', self.missions)
+        self.connection.executemany('INSERT INTO tags (mission_id, position, tag) VALUES (?, ?, ?)', self.tags)
+        self.connection.executemany('INSERT INTO dependencies (mission_id, position, depends_on) VALUES (?, ?, ?)',
+                                    self.dependencies)
+        self.missions = []
+        self.tags = []
+        self.dependencies = []
+
+    def close(self):
+        self.flush()
+        self.connection.commit()
+        self.connection.close()
+
+
+def make_filter(filters: dict[str, list[str]] | None) -> tuple[str, list]:
+    # Values of the same field are alternatives, and every field must match
+    conditions = ['p.game_id = ?']
+    params = []
+    for field, values in (filters or {}).items():
+        conditions.append(FILTERS[field].format(', '.join('?' * len(values))))
+        params.extend(values)
+    return ' AND '.join(conditions), params
+
+
+def read_parts(path: str, game: str | None = None, filters: dict[str, list[str]] | None = None) -> Iterator[dict]:
+    # The game is looked up straight away, so a missing one is reported before any parts are read
+    connection = connect(path)
+    try:
+        game_id = find_game(connection, game)
+    except ValueError:
+        connection.close()
+        raise
+    return read_game_parts(connection, game_id, filters)
+
+
+def read_game_parts(connection: sqlite3.Connection, game_id: int, filters: dict[str, list[str]] | None) \
+        -> Iterator[dict]:
+    condition, params = make_filter(filters)
+    selected = f'SELECT m.id FROM missions m JOIN parts p ON p.id = m.part_id WHERE {condition}'
+    params = [game_id] + params
+
+    missions = connection.execute(f'SELECT m.id, p.id, p.title, m.mission_id, m.title, m.path, m.revision '
+                                  f'FROM missions m JOIN parts p ON p.id = m.part_id WHERE {condition} ORDER BY m.id',
+                                  params)
+    tags = connection.execute(f'SELECT mission_id, tag FROM tags WHERE mission_id IN ({selected}) '
+                              f'ORDER BY mission_id, position', params)
+
+    dependency_query = f'SELECT d.mission_id, d.depends_on FROM dependencies d WHERE d.mission_id IN ({selected})'
+    dependency_params = params
+    if filters:
+        # Only keep dependencies between the selected missions, so filtered out ones do not come back as bare nodes
+        dependency_query += (f' AND d.depends_on IN (SELECT m.mission_id FROM missions m JOIN parts p '
+                             f'ON p.id = m.part_id WHERE {condition})')
+        dependency_params = params + params
+    dependencies = connection.execute(dependency_query + ' ORDER BY d.mission_id, d.position', dependency_params)
+
+    # Missions are inserted in order, so their row ids give the order of the parts and of the missions within them. The
+    # tags and dependencies are sorted the same way and merged in as the missions are read.
+    tag_rows = itertools.groupby(tags, key=lambda row: row[0])
+    dependency_rows = itertools.groupby(dependencies, key=lambda row: row[0])
+    next_tags = next(tag_rows, None)
+    next_dependencies = next(dependency_rows, None)
+
+    def get_missions(rows):
+        nonlocal next_tags, next_dependencies
+        for row, _, _, mission_id, title, path, revision in rows:
+            # Skip the rows of any missions that were not consumed
+            while next_tags is not None and next_tags[0] < row:
+                next_tags = next(tag_rows, None)
+            while next_dependencies is not None and next_dependencies[0] < row:
+                next_dependencies = next(dependency_rows, None)
+
+            mission_tags = []
+            if next_tags is not None and next_tags[0] == row:
+                mission_tags = [tag for _, tag in next_tags[1]]
+                next_tags = next(tag_rows, None)
+
+            depends_on = []
+            if next_dependencies is not None and next_dependencies[0] == row:
+                depends_on = [dependency for _, dependency in next_dependencies[1]]
+                next_dependencies = next(dependency_rows, None)
+
+            yield {'title': title, 'id': mission_id, 'path': path, 'depends_on': depends_on, 'tags': mission_tags,
+                   'revision': revision}
+
+    try:
+        for (_, part_title), rows in itertools.groupby(missions, key=lambda row: (row[1], row[2])):
+            yield {'title': part_title, 'missions': get_missions(rows)}
+    finally:
+        connection.close()
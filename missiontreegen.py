@@ -13,33 +13,28 @@
 #  limitations under the License.
 
 import argparse
-import dataclasses
+import hashlib
+import io
 import json
 import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 
-import bs4
-import graphviz.backend
-from graphviz import Digraph
-from graphviz2drawio import graphviz2drawio
-from tabulate import tabulate
 from termcolor import colored
 
-from extractors import *
+import missiondata
+import missionstore
+from common import HTML_PARSERS, Mission
+from extractors import EXTRACTORS
 from logger import Logger
-from styler import Styler
-
-os.environ["PATH"] += os.pathsep + 'C:/Program Files/Graphviz/bin'
-
-EXTRACTORS = {
-    'rdr': rdr.Rdr
-}
+from profiler import HOOKS, Profiler
+from treegen import build_graph, load_graph, read_parts, render_job, select_nodes, set_graph_attrs, write_dot
 
+# Modules that import bs4, graphviz, requests or tabulate are only imported by the commands that use them, which keeps
+# the CLI quick to start
 
-class EnhancedJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
-        return super().default(o)
+os.environ["PATH"] += os.pathsep + 'C:/Program Files/Graphviz/bin'
 
 
 def main():
@@ -53,6 +48,15 @@ def main():
     # 3 - TRACE
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='enable verbose logging (repeat to increase level of verbosity)')
+    parser.add_argument('--log-file', required=False, help='write log messages to a file instead of the console')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each stage, request and cache counts at the end of the run')
+    parser.add_argument('--profile-trace', required=False,
+                        help='file to write the stage timings to as a Chrome trace (implies --profile)')
+    parser.add_argument('--profile-hook', choices=HOOKS,
+                        help='also run cProfile or tracemalloc around each stage (implies --profile)')
+    parser.add_argument('--profile-dir', default='.',
+                        help='directory to write the cProfile stats of each stage to (default: %(default)s)')
 
     subparsers = parser.add_subparsers(dest='command', required=True)
 
@@ -63,24 +67,169 @@ def main():
     extract_parser = subparsers.add_parser('extract', help='extract data')
     extract_parser.add_argument('--extractor', required=True, help='the extractor to use')
     extract_parser.add_argument('--output-file', required=True, help='output file for the extracted data')
+    extract_parser.add_argument('--jobs', '-j', type=int, default=1,
+                                help='number of pages to fetch concurrently (default: %(default)s)')
+    extract_parser.add_argument('--parse-jobs', type=int, default=1,
+                                help='number of processes to parse pages in, 1 parses them in the main process '
+                                     '(default: %(default)s)')
+    extract_parser.add_argument('--api', action='store_true',
+                                help='look up redirects and page revisions with batched MediaWiki API queries, instead '
+                                     'of following each link')
+    extract_parser.add_argument('--cache-dir', required=False, help='directory to cache downloaded pages in')
+    extract_parser.add_argument('--cache-ttl', type=float, default=86400,
+                                help='seconds before a cached page is revalidated (default: %(default)s)')
+    extract_parser.add_argument('--offline', action='store_true',
+                                help='only use cached pages, never access the network (requires --cache-dir)')
+    extract_parser.add_argument('--resume', action='store_true',
+                                help='skip parts already extracted by a previous interrupted run')
+    extract_parser.add_argument('--incremental', action='store_true',
+                                help='only re-extract missions whose pages changed since the existing output file')
+    extract_parser.add_argument('--parser', choices=HTML_PARSERS,
+                                help='the HTML parser to use (default: the fastest one installed)')
+    extract_parser.add_argument('--output-format', choices=missiondata.FORMATS,
+                                help='format of the output file, ndjson writes each mission as soon as it is '
+                                     'extracted (default: ndjson for .ndjson and .jsonl files, sqlite for .db, .sqlite '
+                                     'and .sqlite3 files, otherwise json)')
+    extract_parser.add_argument('--compact', action='store_true',
+                                help='write JSON output without indentation or spaces, which is smaller and faster to '
+                                     'write')
+    extract_parser.add_argument('--game', required=False,
+                                help='name to store the missions under in a SQLite database, replacing any already '
+                                     'stored with that name (default: the extractor name)')
+    extract_parser.add_argument('--record', required=False,
+                                help='directory to record every response and redirect to, for use with --replay')
+    extract_parser.add_argument('--replay', required=False,
+                                help='extract from responses recorded with --record, served from a local server '
+                                     'instead of the network')
     extract_parser.set_defaults(func=extract)
 
+    serve_fixtures_parser = subparsers.add_parser('serve-fixtures',
+                                                  help='serve responses recorded with extract --record over HTTP')
+    serve_fixtures_parser.add_argument('--archive', required=True, help='directory the responses were recorded to')
+    serve_fixtures_parser.add_argument('--origin', required=False,
+                                       help='the recorded site to serve (default: the first one recorded)')
+    serve_fixtures_parser.add_argument('--host', default='127.0.0.1',
+                                       help='address to listen on (default: %(default)s)')
+    serve_fixtures_parser.add_argument('--port', type=int, default=8080,
+                                       help='port to listen on (default: %(default)s)')
+    serve_fixtures_parser.set_defaults(func=serve_fixtures)
+
     generate_tree_parser = subparsers.add_parser('generate-tree', help='generate a tree')
     generate_tree_parser.add_argument('--dpi', required=False, help='the DPI of the output', default='96')
     generate_tree_parser.add_argument('--engine', required=False, help='the engine', default='dot')
-    generate_tree_parser.add_argument('--format', required=True, help='the format of the tree')
+    generate_tree_parser.add_argument('--format', required=True,
+                                      help='the format of the tree, or a comma separated list of formats')
     generate_tree_parser.add_argument('--input-file', required=True, help='input file to generate the tree from')
     generate_tree_parser.add_argument('--output-file', required=True, help='output file for the generated tree')
     generate_tree_parser.add_argument("--part", required=False, help='the part to generate the tree for')
+    generate_tree_parser.add_argument('--mission', required=False,
+                                      help='the id or title of a mission to generate the tree around')
+    generate_tree_parser.add_argument('--depth', type=int, default=1,
+                                      help='how many levels of prerequisites and dependents to include around --part '
+                                           'or --mission, -1 for all (default: %(default)s)')
+    generate_tree_parser.add_argument('--game', required=False,
+                                      help='the game to read from a SQLite database that has several')
+    generate_tree_parser.add_argument('--where', action='append', metavar='FIELD=VALUE', type=parse_filter,
+                                      help='only include missions with the given tag, part or id, and the dependencies '
+                                           'between them (repeatable, values of the same field are alternatives and '
+                                           'every field must match)')
     generate_tree_parser.add_argument('--style', required=False, help='the style file')
     generate_tree_parser.add_argument('--subgraphs', required=False, default=False,
                                       help='draw borders around each part')
+    generate_tree_parser.add_argument('--direct', action='store_true',
+                                      help='write the DOT source to the layout engine without building a Digraph, '
+                                           'faster for large graphs')
+    generate_tree_parser.add_argument('--all-parts', action='store_true',
+                                      help='generate a tree for each part, named <output-file>-<part>.<format>')
+    generate_tree_parser.add_argument('--jobs', '-j', type=int, default=None,
+                                      help='number of trees to lay out at once when generating several '
+                                           '(default: the number of CPUs)')
+    generate_tree_parser.add_argument('--check', action='store_true',
+                                      help='report dependency cycles and dependencies on unknown missions')
+    generate_tree_parser.add_argument('--reduce', action='store_true',
+                                      help='remove dependencies that are already implied by other dependencies')
+    generate_tree_parser.add_argument('--save-layout', required=False,
+                                      help='file to save the positions of the nodes to, for use with --pin-layout')
+    generate_tree_parser.add_argument('--pin-layout', required=False,
+                                      help='keep unchanged nodes where they were in a layout saved with --save-layout, '
+                                           'so only new and changed nodes are placed (uses neato instead of dot)')
+    generate_tree_parser.add_argument('--render-cache', required=False,
+                                      help='directory to cache rendered graphs in, unchanged graphs are not laid out '
+                                           'again')
+    generate_tree_parser.add_argument('--render-cache-size', type=int, default=512,
+                                      help='maximum size of the render cache in MB (default: %(default)s)')
     generate_tree_parser.set_defaults(func=generate_tree)
 
+    watch_parser = subparsers.add_parser('watch',
+                                         help='generate a tree again whenever its input, style or images change')
+    watch_parser.add_argument('--input-file', required=True, help='input file to generate the tree from')
+    watch_parser.add_argument('--output-file', required=True, help='output file for the generated tree')
+    watch_parser.add_argument('--format', default='svg', help='the format of the tree (default: %(default)s)')
+    watch_parser.add_argument('--engine', default='dot', help='the engine (default: %(default)s)')
+    watch_parser.add_argument('--dpi', default='96', help='the DPI of the output (default: %(default)s)')
+    watch_parser.add_argument('--style', required=False, help='the style file')
+    watch_parser.add_argument('--subgraphs', action='store_true', help='draw borders around each part')
+    watch_parser.add_argument('--game', required=False, help='the game to read from a SQLite database that has several')
+    watch_parser.add_argument('--where', action='append', metavar='FIELD=VALUE', type=parse_filter,
+                              help='only include missions with the given tag, part or id (repeatable)')
+    watch_parser.add_argument('--part', required=False, help='the part to generate the tree for')
+    watch_parser.add_argument('--mission', required=False,
+                              help='the id or title of a mission to generate the tree around')
+    watch_parser.add_argument('--depth', type=int, default=1,
+                              help='how many levels of prerequisites and dependents to include around --part or '
+                                   '--mission, -1 for all (default: %(default)s)')
+    watch_parser.add_argument('--interval', type=float, default=0.5,
+                              help='seconds between checks for changed files (default: %(default)s)')
+    watch_parser.add_argument('--serve', action='store_true', help='serve the latest tree over HTTP')
+    watch_parser.add_argument('--host', default='127.0.0.1', help='address to serve on (default: %(default)s)')
+    watch_parser.add_argument('--port', type=int, default=8000, help='port to serve on (default: %(default)s)')
+    watch_parser.set_defaults(func=watch)
+
     args = parser.parse_args()
     Logger.set_level(args.verbose)
 
-    args.func(args)
+    if args.profile or args.profile_trace is not None or args.profile_hook is not None:
+        Profiler.enable(args.profile_trace is not None, args.profile_hook, args.profile_dir)
+
+    if args.log_file is not None:
+        Logger.open_sink(args.log_file)
+    try:
+        with Profiler.stage(args.func.__name__):
+            args.func(args)
+    finally:
+        Logger.close_sink()
+
+    if Profiler.enabled:
+        print_profile(args)
+
+
+def print_profile(args):
+    from tabulate import tabulate
+
+    stages = sorted(Profiler.stages.items(), key=lambda item: item[1][1], reverse=True)
+    table = [[name, calls, seconds, seconds / calls * 1000] for name, (calls, seconds, _) in stages]
+    headers = ['STAGE', 'CALLS', 'SECONDS', 'MS/CALL']
+    if args.profile_hook == 'tracemalloc':
+        for row, (_, (_, _, allocated)) in zip(table, stages):
+            row.append(allocated / (1024 * 1024))
+        headers.append('ALLOCATED MB')
+    print('Profile:')
+    print(format_tabulate_line(tabulate(table, headers, tablefmt='plain', floatfmt='.3f'), '\t{line}'))
+
+    counters = [[name, value] for name, value in sorted(Profiler.counters.items())]
+    for name, hits, misses in [('cache.hit_rate', 'cache.hits', 'cache.misses'),
+                               ('render_cache.hit_rate', 'render_cache.hits', 'render_cache.misses')]:
+        hit_rate = Profiler.get_hit_rate(hits, misses)
+        if hit_rate is not None:
+            counters.append([name, f'{hit_rate:.1%}'])
+    if len(counters) > 0:
+        print(format_tabulate_line(tabulate(counters, ['COUNTER', 'VALUE'], tablefmt='plain'), '\t{line}'))
+
+    for path in Profiler.save_profiles():
+        Logger.log_info('cProfile stats saved to %s', path)
+    if args.profile_trace is not None:
+        Profiler.write_trace(args.profile_trace)
+        Logger.log_info('Profile trace saved to %s', args.profile_trace)
 
 
 def format_tabulate_line(table, line_fmt):
@@ -88,6 +237,10 @@ def format_tabulate_line(table, line_fmt):
 
 
 def info(args):
+    import bs4
+    import graphviz
+    from tabulate import tabulate
+
     if args.extractor:
         if args.extractor in EXTRACTORS:
             extractor = EXTRACTORS[args.extractor]
@@ -132,71 +285,373 @@ def info(args):
 
 
 def extract(args):
-    Logger.log_info(f"Extracting data of type: {args.extractor}")
-    Logger.log_info(f"Output will be saved to: {args.output_file}")
+    Logger.log_info('Extracting data of type: %s', args.extractor)
+    Logger.log_info('Output will be saved to: %s', args.output_file)
+
+    if args.extractor not in EXTRACTORS:
+        Logger.log_info('No extractor found with the name "%s"', args.extractor, color='red')
+        return
+    if args.offline and args.cache_dir is None:
+        Logger.log_info('--offline requires --cache-dir', color='red')
+        return
 
+    from extractor import WebExtractor
+    from fixtures import FixtureArchive, ReplayServer
+
+    server = None
+    if args.replay is not None:
+        server = ReplayServer(FixtureArchive(args.replay))
+        if server.origin is None:
+            Logger.log_info('No responses recorded in "%s"', args.replay, color='red')
+            server.server_close()
+            return
+        server.start()
+        WebExtractor.set_origin(server.origin, server.url)
+        Logger.log_info('Replaying %d responses recorded from %s', len(server.records), server.origin)
+    if args.record is not None:
+        WebExtractor.set_recorder(FixtureArchive(args.record))
+
+    try:
+        extract_parts(args)
+    finally:
+        WebExtractor.close_parse_pool()
+        if server is not None:
+            server.stop()
+
+
+def extract_parts(args):
+    from cache import ResponseCache
+    from checkpoint import Checkpoint
+    from extractor import WebExtractor
+
+    WebExtractor.set_jobs(args.jobs)
+    WebExtractor.set_parse_jobs(args.parse_jobs)
+    WebExtractor.set_parser(args.parser)
+    WebExtractor.set_use_api(args.api)
+    if args.cache_dir is not None:
+        WebExtractor.set_cache(ResponseCache(args.cache_dir, args.cache_ttl), args.offline)
     extractor = EXTRACTORS[args.extractor]()
 
+    if args.game is None:
+        args.game = args.extractor
+
+    if args.incremental:
+        previous = load_previous_missions(args.output_file, args.game)
+        Logger.log_info('Loaded %d missions from previous extraction', len(previous))
+        extractor.set_previous_missions(previous)
+
+    checkpoint = Checkpoint(args.output_file + '.checkpoint', args.extractor)
+    done_parts = {}
+    if args.resume:
+        done_parts = checkpoint.load()
+        Logger.log_info('Resuming with %d parts already extracted', len(done_parts))
+    checkpoint.start(done_parts)
+
     Logger.log_info("Getting parts")
     parts = extractor.get_parts()
     if parts is None:
         return
 
-    data = {'parts': []}
+    writer = missiondata.make_writer(args.output_file, args.output_format, args.game, args.compact)
 
     for part in parts:
-        Logger.log_info(colored(f"Getting missions for part {part.title}", "light_grey"))
-        missions = extractor.get_missions(part.title)
-        data['parts'].append({'title': part.title, 'missions': missions})
+        writer.add_part(part.title)
 
-    with open(args.output_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4, cls=EnhancedJSONEncoder)
+        if part.title in done_parts:
+            Logger.log_info('Skipping part %s, already extracted', part.title, color='light_grey')
+            for mission in done_parts[part.title]:
+                writer.add_mission(mission)
+            continue
+
+        Logger.log_info('Getting missions for part %s', part.title, color='light_grey')
+        missions = []
+        for mission in extractor.get_missions(part.title):
+            writer.add_mission(mission)
+            missions.append(mission)
+        checkpoint.add_part(part.title, missions)
+
+    writer.close()
+    checkpoint.remove()
+
+
+def serve_fixtures(args):
+    from fixtures import FixtureArchive, ReplayServer
+
+    server = ReplayServer(FixtureArchive(args.archive), args.origin, args.host, args.port)
+    if server.origin is None:
+        Logger.log_info('No responses recorded in "%s"', args.archive, color='red')
+        server.server_close()
+        return
+
+    Logger.log_info('Serving %d responses recorded from %s at %s', len(server.records), server.origin, server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def load_previous_missions(path, game) -> dict[str, Mission]:
+    try:
+        return {mission['path']: Mission.from_dict(mission) for mission in missiondata.read_missions(path, game)}
+    except (OSError, ValueError) as e:
+        Logger.log_info('Failed to load previous extraction "%s": %s', path, e, color='yellow')
+        return {}
+
+
+def parse_filter(value):
+    field, separator, filter_value = value.partition('=')
+    if separator == '' or field not in missionstore.FILTERS:
+        raise argparse.ArgumentTypeError(f'expected FIELD=VALUE with FIELD one of: {", ".join(missionstore.FILTERS)}')
+    return field, filter_value
+
+
+@contextmanager
+def layout_output(args, layout):
+    # Extra engine arguments that also write the positions of the nodes, which are saved once the engine has finished
+    if args.save_layout is None:
+        yield []
+        return
+
+    fd, json_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        yield ['-Tjson', '-o', json_path]
+        with open(json_path, 'r', encoding='utf-8') as f:
+            layout.save(args.save_layout, json.load(f))
+    finally:
+        os.remove(json_path)
 
 
 def generate_tree(args):
-    Logger.log_info(f"Generating tree from: {args.input_file}")
-    Logger.log_info(f"Output will be saved to: {args.output_file}")
+    from graphviz import Digraph, view
+
+    from dotwriter import open_layout_pipe
+    from layout import Layout
+    from rendercache import RenderCache
+    from styler import Styler
 
-    with open(args.input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    Logger.log_info('Generating tree from: %s', args.input_file)
+    Logger.log_info('Output will be saved to: %s', args.output_file)
 
     Styler.load_style(args.style)
 
-    fmt = args.format
-    if args.format == 'drawio':
-        fmt = 'png'
-
-    dot = Digraph(comment='Mission Dependency Graph', format=fmt, engine=args.engine)
-    dot.attr(overlap='false')
-    dot.attr(sep='0.5')
-    dot.attr(splines='true')
-    dot.attr(rankdir='TB')
-    dot.attr(dpi=args.dpi)
-
-    for part in data['parts']:
-        if args.subgraphs:
-            with dot.subgraph(name=f'cluster_{part['title'].replace(" ", "_")}') as c:
-                c.attr(label=part['title'], color='blue', style='dashed')
-                for mission in part['missions']:
-                    Styler.make_node(dot, mission['id'], mission['title'], mission['tags'])
-
-                    for dependency in mission['depends_on']:
-                        c.edge(dependency, mission['id'])
-        else:
-            for mission in part['missions']:
-                Styler.make_node(dot, mission['id'], mission['title'], mission['tags'])
+    render_cache = None
+    if args.render_cache is not None:
+        render_cache = RenderCache(args.render_cache, args.render_cache_size * 1024 * 1024)
+
+    formats = args.format.split(',')
+    if args.all_parts or len(formats) > 1:
+        generate_batch(args, formats, render_cache)
+        return
+
+    layout = None
+    if args.pin_layout is not None or args.save_layout is not None:
+        layout = Layout(args.pin_layout)
+    if args.pin_layout is not None and args.engine == 'dot':
+        Logger.log_info('The dot engine cannot keep nodes in place, using neato instead')
+        args.engine = 'neato'
+
+    parts = read_parts(args)
+    if parts is None:
+        return
+    if args.check or args.reduce or args.part is not None or args.mission is not None:
+        graph = load_graph(parts, args)
+        nodes = select_nodes(graph, args)
+        if nodes is None and (args.part is not None or args.mission is not None):
+            return
+        parts = graph.to_parts(nodes)
 
-                for dependency in mission['depends_on']:
-                    dot.edge(dependency, mission['id'])
+    if args.direct:
+        generate_tree_direct(args, parts, render_cache, layout)
+        return
+
+    dot = Digraph(comment='Mission Dependency Graph', engine=args.engine)
+    set_graph_attrs(dot, args.dpi, layout)
+    build_graph(dot, parts, args.subgraphs, layout)
 
     if args.format != 'drawio':
-        render_name = dot.render(f'{args.output_file}', view=True)
-        Logger.log_info(f'Graph saved as {render_name}')
+        dot.format = args.format
+        render_name = f'{args.output_file}.{args.format}'
+        key = None
+        if render_cache is not None:
+            key = get_render_key(hashlib.sha256(dot.source.encode('utf-8')), args)
+            if render_cache.get(key, render_name):
+                dot.save(f'{args.output_file}')
+                view(render_name)
+                Logger.log_info('Graph saved as %s', render_name)
+                return
+
+        if args.save_layout is None:
+            with Profiler.stage('layout'):
+                render_name = dot.render(f'{args.output_file}', view=True)
+        else:
+            dot.save(f'{args.output_file}')
+            with Profiler.stage('layout'), layout_output(args, layout) as extra_args, \
+                    open_layout_pipe(args.engine, args.format, render_name, extra_args) as pipe:
+                pipe.write(dot.source)
+            view(render_name)
+
+        if key is not None:
+            render_cache.put(key, render_name)
+        Logger.log_info('Graph saved as %s', render_name)
     else:
-        output_name = dot.save(f'{args.output_file}' + '.dot')
-        xml = graphviz2drawio.convert(output_name)
-        with open(args.output_file, 'w', encoding='utf-8') as f2:
-            f2.write(xml)
+        render_drawio_cached(dot.source, args, render_cache, layout)
+
+
+def watch(args):
+    from watcher import TreeWatcher, WatchServer
+
+    if args.format == 'drawio' and args.serve:
+        Logger.log_info('Only trees rendered by the layout engine can be served', color='red')
+        return
+
+    watcher = TreeWatcher(args)
+    server = None
+    if args.serve:
+        try:
+            server = WatchServer(watcher, args.host, args.port)
+        except OSError as e:
+            Logger.log_info('Failed to serve on %s:%d: %s', args.host, args.port, e, color='red')
+            return
+        server.start()
+        Logger.log_info('Serving the latest tree at %s', server.url)
+    try:
+        watcher.run()
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def get_render_key(source_hasher, args) -> str:
+    from rendercache import RenderCache
+    from styler import Styler
+
+    return RenderCache.get_key(source_hasher.hexdigest(), args.engine, args.format, args.dpi, Styler.get_image_paths())
+
+
+def render_drawio_cached(source, args, render_cache, layout=None):
+    import drawio
+
+    key = None
+    if render_cache is not None:
+        key = get_render_key(hashlib.sha256(source.encode('utf-8')), args)
+        if render_cache.get(key, args.output_file):
+            Logger.log_info('Graph saved as %s', args.output_file)
+            return
+
+    with Profiler.stage('layout'):
+        graph = drawio.render(source, args.engine, args.output_file)
+    if args.save_layout is not None:
+        layout.save(args.save_layout, graph)
+    if key is not None:
+        render_cache.put(key, args.output_file)
+    Logger.log_info('Graph saved as %s', args.output_file)
+
+
+def generate_tree_direct(args, parts, render_cache, layout=None):
+    from dotwriter import open_layout_pipe
+    from rendercache import RenderCache
+
+    if args.format == 'drawio':
+        source = io.StringIO()
+        write_dot(source, parts, args, layout)
+        render_drawio_cached(source.getvalue(), args, render_cache, layout)
+        return
+
+    render_name = f'{args.output_file}.{args.format}'
+    if render_cache is None:
+        # The engine is started before the graph is built, and DotWriter writes the source to it once it is closed, so
+        # this stage includes building it
+        with Profiler.stage('layout'), layout_output(args, layout) as extra_args, \
+                open_layout_pipe(args.engine, args.format, render_name, extra_args) as pipe:
+            write_dot(pipe, parts, args, layout)
+        Logger.log_info('Graph saved as %s', render_name)
+        return
+
+    # The whole source is needed to look up the cache, so it is written to a file rather than piped
+    with open(args.output_file, 'w', encoding='utf-8') as f:
+        write_dot(f, parts, args, layout)
+
+    key = get_render_key(RenderCache.hash_file(args.output_file), args)
+    if not render_cache.get(key, render_name):
+        with Profiler.stage('layout'), layout_output(args, layout) as extra_args, \
+                open_layout_pipe(args.engine, args.format, render_name, extra_args) as pipe, \
+                open(args.output_file, 'r', encoding='utf-8') as f:
+            shutil.copyfileobj(f, pipe)
+        render_cache.put(key, render_name)
+    Logger.log_info('Graph saved as %s', render_name)
+
+
+def generate_batch(args, formats, render_cache):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    from tabulate import tabulate
+
+    from rendercache import RenderCache
+    from styler import Styler
+
+    if args.pin_layout is not None or args.save_layout is not None:
+        Logger.log_info('Layouts are not saved or pinned when generating several trees', color='yellow')
+
+    parts = read_parts(args)
+    if parts is None:
+        return
+    graph = load_graph(parts, args)
+
+    # Each view is laid out once per format
+    views = []
+    if args.all_parts:
+        for part_index, title in enumerate(graph.part_titles):
+            nodes = graph.get_closure(graph.get_part_nodes(part_index), args.depth if args.depth >= 0 else None)
+            views.append((title, f'{args.output_file}-{Mission.sanitize_string(title)}', graph.to_parts(nodes)))
+    else:
+        nodes = select_nodes(graph, args)
+        if nodes is None and (args.part is not None or args.mission is not None):
+            return
+        views.append((args.part or args.mission or 'all', args.output_file, graph.to_parts(nodes)))
+
+    jobs = []
+    for name, output_base, parts in views:
+        source = io.StringIO()
+        write_dot(source, parts, args)
+        source = source.getvalue()
+        source_hasher = hashlib.sha256(source.encode('utf-8'))
+
+        for fmt in formats:
+            output_path = f'{output_base}.{fmt}'
+            key = None
+            if render_cache is not None:
+                key = RenderCache.get_key(source_hasher.hexdigest(), args.engine, fmt, args.dpi,
+                                          Styler.get_image_paths())
+            jobs.append((name, fmt, output_path, source, key))
+
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for i, (name, fmt, output_path, source, key) in enumerate(jobs):
+            if key is not None and render_cache.get(key, output_path):
+                results[i] = [name, fmt, output_path, 0.0, colored('cached', 'green')]
+                continue
+            futures[executor.submit(render_job, source, args.engine, fmt, output_path)] = i
+
+        for future in as_completed(futures):
+            i = futures[future]
+            name, fmt, output_path, source, key = jobs[i]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                results[i] = [name, fmt, output_path, None, colored(f'failed: {e}', 'red')]
+                continue
+
+            if key is not None:
+                render_cache.put(key, output_path)
+            Logger.log_verbose('Rendered %s in %.2fs', output_path, elapsed)
+            results[i] = [name, fmt, output_path, elapsed, colored('ok', 'green')]
+
+    headers = ['VIEW', 'FORMAT', 'OUTPUT', 'SECONDS', 'STATUS']
+    print(format_tabulate_line(tabulate(results, headers, tablefmt='plain', floatfmt='.2f'), '\t{line}'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+from logger import Logger
+
+HOOKS = ['cprofile', 'tracemalloc']
+
+
+# Wall time per stage and named counters, collected from every thread while profiling is enabled. Stages can be nested,
+# so the time of a stage includes the stages inside it.
+class Profiler:
+    enabled: bool = False
+    lock = threading.Lock()
+    start_time: float = 0
+    # Stage name to [calls, seconds, bytes of traced memory still allocated when the stage ended]
+    stages: dict[str, list] = {}
+    counters: dict[str, int] = {}
+    # Complete events in the Chrome trace event format, only kept when a trace file is written
+    events: list[dict] | None = None
+    hook: str | None = None
+    hook_dir: str = '.'
+    profiles: dict[str, cProfile.Profile] = {}
+    profile_stack: list[cProfile.Profile] = []
+
+    @staticmethod
+    def enable(trace: bool = False, hook: str | None = None, hook_dir: str = '.'):
+        Profiler.enabled = True
+        Profiler.start_time = time.perf_counter()
+        Profiler.events = [] if trace else None
+        Profiler.hook = hook
+        Profiler.hook_dir = hook_dir
+        if hook == 'tracemalloc':
+            tracemalloc.start()
+
+    @staticmethod
+    def count(name: str, amount: int = 1):
+        if not Profiler.enabled:
+            return
+        with Profiler.lock:
+            Profiler.counters[name] = Profiler.counters.get(name, 0) + amount
+
+    @staticmethod
+    def stage(name: str, trace: bool = True):
+        # Stages called for every node are not added to the trace, which would otherwise have an event per node
+        if not Profiler.enabled:
+            return nullcontext()
+        return Profiler.run_stage(name, trace)
+
+    @staticmethod
+    @contextmanager
+    def run_stage(name: str, trace: bool):
+        # Hooks only run in the main thread. cProfile cannot profile two stages at once, so the profile of the enclosing
+        # stage is paused while a nested one runs, and each profile only has the time spent in its own stage.
+        hooked = trace and Profiler.hook is not None and threading.current_thread() is threading.main_thread()
+        profile = None
+        snapshot = None
+        memory = 0
+        if hooked and Profiler.hook == 'cprofile':
+            if len(Profiler.profile_stack) > 0:
+                Profiler.profile_stack[-1].disable()
+            profile = Profiler.profiles.setdefault(name, cProfile.Profile())
+            Profiler.profile_stack.append(profile)
+            profile.enable()
+        elif hooked and Profiler.hook == 'tracemalloc':
+            memory = tracemalloc.get_traced_memory()[0]
+            snapshot = tracemalloc.take_snapshot()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            if profile is not None:
+                profile.disable()
+                Profiler.profile_stack.pop()
+                if len(Profiler.profile_stack) > 0:
+                    Profiler.profile_stack[-1].enable()
+            elif snapshot is not None:
+                memory = tracemalloc.get_traced_memory()[0] - memory
+                for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')[:10]:
+                    Logger.log_debug('%s: %s', name, stat)
+
+            with Profiler.lock:
+                stage = Profiler.stages.setdefault(name, [0, 0.0, 0])
+                stage[0] += 1
+                stage[1] += elapsed
+                stage[2] += memory
+                if trace and Profiler.events is not None:
+                    Profiler.events.append({
+                        'name': name,
+                        'ph': 'X',
+                        'ts': (start - Profiler.start_time) * 1e6,
+                        'dur': elapsed * 1e6,
+                        'pid': os.getpid(),
+                        'tid': threading.get_ident(),
+                    })
+
+    @staticmethod
+    def get_hit_rate(hits: str, misses: str) -> float | None:
+        total = Profiler.counters.get(hits, 0) + Profiler.counters.get(misses, 0)
+        if total == 0:
+            return None
+        return Profiler.counters.get(hits, 0) / total
+
+    @staticmethod
+    def save_profiles() -> list[str]:
+        paths = []
+        for name, profile in Profiler.profiles.items():
+            path = os.path.join(Profiler.hook_dir, f'{name}.prof')
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    @staticmethod
+    def write_trace(path: str):
+        # Opens in chrome://tracing or https://ui.perfetto.dev
+        data = {
+            'traceEvents': Profiler.events or [],
+            'stages': {name: {'calls': calls, 'seconds': seconds, 'allocated_bytes': allocated}
+                       for name, (calls, seconds, allocated) in Profiler.stages.items()},
+            'counters': Profiler.counters,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
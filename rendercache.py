@@ -0,0 +1,88 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import os
+import shutil
+
+from logger import Logger
+from profiler import Profiler
+
+
+# Stores rendered graphs keyed by everything that affects the output: the DOT source, the layout options and the
+# contents of the images the nodes reference. The least recently used artifacts are evicted once the cache is larger
+# than max_size bytes.
+class RenderCache:
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_file(path: str, hasher=None):
+        if hasher is None:
+            hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(1024 * 1024):
+                hasher.update(chunk)
+        return hasher
+
+    @staticmethod
+    def get_key(source_hash: str, engine: str, fmt: str, dpi: str, image_paths) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(f'{source_hash}\0{engine}\0{fmt}\0{dpi}\0'.encode('utf-8'))
+        for image_path in sorted(image_paths):
+            hasher.update(image_path.encode('utf-8') + b'\0')
+            if os.path.exists(image_path):
+                RenderCache.hash_file(image_path, hasher)
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def get_artifact_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str, output_path: str) -> bool:
+        artifact_path = self.get_artifact_path(key)
+        if not os.path.exists(artifact_path):
+            Logger.log_verbose('Render cache miss for %s', key, color='yellow')
+            Profiler.count('render_cache.misses')
+            return False
+
+        Logger.log_verbose('Render cache hit for %s', key, color='green')
+        Profiler.count('render_cache.hits')
+        shutil.copyfile(artifact_path, output_path)
+        # Mark the artifact as recently used
+        os.utime(artifact_path)
+        return True
+
+    def put(self, key: str, output_path: str):
+        shutil.copyfile(output_path, self.get_artifact_path(key))
+        self.evict()
+
+    def evict(self):
+        artifacts = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        artifacts.sort()
+        for _, size, path in artifacts:
+            if total_size <= self.max_size:
+                break
+            Logger.log_verbose('Evicting %s from render cache', os.path.basename(path), color='cyan')
+            os.remove(path)
+            total_size -= size
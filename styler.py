@@ -15,11 +15,27 @@
 import json
 
 from logger import Logger
+from profiler import Profiler
 
 
 class Styler:
+    style: dict | None = None
+    style_engine: str | None = None
+    # Selector to the index of its rule, rules are kept in style file order with inheritance already applied
+    rules: dict[str, int] = {}
+    rule_styles: list[dict] = []
+    # Matching rule indexes to the resolved style, and to the node attributes and HTML label template made from it
+    styles: dict[tuple[int, ...], dict | None] = {}
+    node_templates: dict[tuple[int, ...], tuple[dict, tuple[str, str] | None] | None] = {}
+
     @classmethod
     def load_style(cls, style_path):
+        cls.style = None
+        cls.rules = {}
+        cls.rule_styles = []
+        cls.styles = {}
+        cls.node_templates = {}
+
         if style_path is None:
             cls.style_engine = None
             return
@@ -27,41 +43,66 @@ class Styler:
         with open(style_path, 'r', encoding='utf-8') as f:
             cls.style = json.load(f)
 
+        cls.compile_style()
+
         cls.style_engine = 'gv'
         if 'engine' in cls.style:
             cls.style_engine = cls.style['engine']
             if cls.style_engine != 'gv' and cls.style_engine != 'html':
-                print('Invalid style engine, must be gv or html')
+                Logger.log_info('Invalid style engine, must be gv or html', color='red')
                 return
 
     @classmethod
-    def get_style(cls, node_id, tags):
-        if cls.style is None:
-            return None
-
-        matching_styles = []
-
+    def compile_style(cls):
         for selector, selector_style in cls.style.items():
             if selector == 'engine':
                 continue
 
-            Logger.log_trace(f'Selector: {selector} for tags {tags}, id {node_id}')
-            if selector in tags or selector == '#' + node_id:
-                if 'inherit' in selector_style:
-                    if selector_style['inherit'] in cls.style:
-                        matching_styles.append(cls.style[selector_style['inherit']] | selector_style)
-                        continue
-                matching_styles.append(selector_style)
-
-        if len(matching_styles) < 1:
-            if 'default' not in cls.style:
-                return None
-            node_style = cls.style['default']
+            if 'inherit' in selector_style:
+                if selector_style['inherit'] in cls.style:
+                    selector_style = cls.style[selector_style['inherit']] | selector_style
+            cls.rules[selector] = len(cls.rule_styles)
+            cls.rule_styles.append(selector_style)
+
+    @classmethod
+    def get_image_paths(cls) -> set[str]:
+        if cls.style is None:
+            return set()
+
+        node_styles = cls.rule_styles + [cls.style.get('default', {})]
+        return {'images/' + node_style['image'] for node_style in node_styles if 'image' in node_style}
+
+    @classmethod
+    def get_style_key(cls, node_id, tags) -> tuple[int, ...]:
+        indexes = {cls.rules[tag] for tag in tags if tag in cls.rules}
+        id_rule = cls.rules.get('#' + node_id)
+        if id_rule is not None:
+            indexes.add(id_rule)
+
+        # Later selectors in the style file take precedence, so the styles are merged in file order
+        return tuple(sorted(indexes))
+
+    @classmethod
+    def get_style_for_key(cls, key):
+        if key in cls.styles:
+            return cls.styles[key]
+
+        if len(key) < 1:
+            node_style = cls.style.get('default')
         else:
-            node_style = {k: v for style in matching_styles for k, v in style.items()}
+            node_style = {k: v for index in key for k, v in cls.rule_styles[index].items()}
 
+        Logger.log_trace('Resolved style %s for selectors %s', node_style, key)
+        cls.styles[key] = node_style
         return node_style
 
+    @classmethod
+    def get_style(cls, node_id, tags):
+        if cls.style is None:
+            return None
+
+        return cls.get_style_for_key(cls.get_style_key(node_id, tags))
+
     @classmethod
     def set_attr_if_exists(cls, node_style, attrs, style_name, attr_name, validator=None):
         if style_name in node_style:
@@ -107,7 +148,7 @@ class Styler:
         return attrs
 
     @classmethod
-    def make_html(cls, node_style, title):
+    def make_html_template(cls, node_style) -> tuple[str, str]:
         image_html = ''
         image_width = ''
         image_height = ''
@@ -139,27 +180,58 @@ class Styler:
         if 'font' in node_style:
             font = f'FACE="{node_style['font']}"'
 
-        html += f'<TD><FONT {font_color} {font_size} {font}>' + title + '</FONT></TD>'
+        html += f'<TD><FONT {font_color} {font_size} {font}>'
+        html_after = '</FONT></TD>'
 
         if image_pos in ['tr', 'mr', 'br']:
-            html += image_html
+            html_after += image_html
 
-        html += '</TR></TABLE>'
+        html_after += '</TR></TABLE>'
 
-        Logger.log_trace(f'Generated HTML = {html}')
+        return html, html_after
+
+    @classmethod
+    def make_html(cls, node_style, title):
+        html_before, html_after = cls.make_html_template(node_style)
+        html = html_before + title + html_after
+
+        Logger.log_trace('Generated HTML = %s', html)
 
         return f'<{html}>'
 
     @classmethod
-    def make_node(cls, graph, node_id, title, tags):
-        node_style = cls.get_style(node_id, tags)
-        if node_style is None:
-            graph.node(node_id, title)
-            return
+    def get_node_template(cls, node_id, tags):
+        if cls.style is None:
+            return None
+
+        key = cls.get_style_key(node_id, tags)
+        if key in cls.node_templates:
+            return cls.node_templates[key]
 
-        if cls.style_engine == 'gv':
-            graph.node(node_id, title, **cls.make_kwargs(node_style))
+        node_style = cls.get_style_for_key(key)
+        if node_style is None:
+            template = None
+        elif cls.style_engine == 'gv':
+            template = (cls.make_kwargs(node_style), None)
         elif cls.style_engine == 'html':
-            graph.node(node_id, cls.make_html(node_style, title), **cls.make_html_kwargs(node_style), margin='0')
+            template = (cls.make_html_kwargs(node_style) | {'margin': '0'}, cls.make_html_template(node_style))
         else:
-            graph.node(node_id, title)
+            template = None
+
+        cls.node_templates[key] = template
+        return template
+
+    @classmethod
+    def make_node(cls, graph, node_id, title, tags, attributes=None):
+        with Profiler.stage('Styler.make_node', trace=False):
+            template = cls.get_node_template(node_id, tags)
+            if template is None:
+                graph.node(node_id, title, _attributes=attributes)
+                return
+
+            kwargs, html_template = template
+            if html_template is None:
+                graph.node(node_id, title, _attributes=attributes, **kwargs)
+            else:
+                graph.node(node_id, f'<{html_template[0]}{title}{html_template[1]}>', _attributes=attributes,
+                           **kwargs)
@@ -0,0 +1,60 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import importlib.util
+import os
+
+import pytest
+
+from extractor import WebExtractor
+from extractors.rdr import PARSE_ONLY, Rdr
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'rdr')
+FIXTURES = sorted(name for name in os.listdir(FIXTURES_DIR) if name.endswith('.html'))
+NEEDS_LXML = pytest.mark.skipif(importlib.util.find_spec('lxml') is None, reason='lxml is not installed')
+
+EXPECTED = {
+    'giver_location_prerequisites.html': ('bonniemacfarlane', 'macfarlanesranch',
+                                          ['/wiki/New_Friends,_Old_Problems', '/wiki/Jenny_Hotchkiss_(Stranger)']),
+    'starts_automatically.html': ('bonniemacfarlane', None, ['/wiki/Exodus_in_America#Walkthrough']),
+    'no_article_content.html': ('bonnie', 'hennigansstead',
+                                ['/wiki/Exodus_in_America', '/wiki/Old_Friends,_New_Problems']),
+}
+
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+def extract(html_page: bytes, parser: str, parse_only) -> tuple:
+    soup = WebExtractor.parse_html(html_page, parser, parse_only)
+    return Rdr.get_mission_given_by(soup), Rdr.get_mission_location(soup), Rdr.get_depend_links(soup)
+
+
+# html.parser without a strainer is how pages were parsed before lxml and the strainer were added
+@pytest.mark.parametrize('name', FIXTURES)
+@pytest.mark.parametrize('parser, parse_only', [
+    ('html.parser', PARSE_ONLY),
+    pytest.param('lxml', None, marks=NEEDS_LXML),
+    pytest.param('lxml', PARSE_ONLY, marks=NEEDS_LXML),
+])
+def test_parser_parity(name, parser, parse_only):
+    html_page = read_fixture(name)
+    assert extract(html_page, parser, parse_only) == extract(html_page, 'html.parser', None)
+
+
+@pytest.mark.parametrize('name', FIXTURES)
+def test_expected_results(name):
+    assert extract(read_fixture(name), 'html.parser', None) == EXPECTED[name]
@@ -0,0 +1,167 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import subprocess
+import time
+
+import missiondata
+from logger import Logger
+from profiler import Profiler
+
+# Builds and renders mission trees for the generate-tree and watch commands
+
+
+def read_parts(args):
+    filters = {}
+    for field, value in args.where or []:
+        filters.setdefault(field, []).append(value)
+
+    try:
+        return missiondata.read_parts(args.input_file, args.game, filters)
+    except (OSError, ValueError) as e:
+        Logger.log_info('Failed to read "%s": %s', args.input_file, e, color='red')
+        return None
+
+
+def set_graph_attrs(graph, dpi, layout=None):
+    graph.attr(overlap='false')
+    graph.attr(sep='0.5')
+    graph.attr(splines='true')
+    graph.attr(rankdir='TB')
+    graph.attr(dpi=dpi)
+    if layout is not None:
+        # Keep the coordinates as they are, so the saved positions match the next run's pinned ones
+        graph.attr(notranslate='true')
+
+
+def make_mission_node(graph, mission, layout):
+    from styler import Styler
+
+    attributes = None
+    if layout is not None:
+        pin = layout.get_pin(mission)
+        if pin is not None:
+            attributes = {'pos': pin}
+    Styler.make_node(graph, mission['id'], mission['title'], mission['tags'], attributes)
+
+
+def build_graph(graph, parts, subgraphs, layout=None):
+    with Profiler.stage('build_graph'):
+        node_count, edge_count = add_parts(graph, parts, subgraphs, layout)
+    Profiler.count('graph.nodes', node_count)
+    Profiler.count('graph.edges', edge_count)
+
+    if layout is not None and layout.pinned > 0:
+        Logger.log_verbose('Pinned %d nodes to their previous positions', layout.pinned)
+
+
+def add_parts(graph, parts, subgraphs, layout) -> tuple[int, int]:
+    node_count = 0
+    edge_count = 0
+    for part in parts:
+        if subgraphs:
+            with graph.subgraph(name=f'cluster_{part['title'].replace(" ", "_")}') as c:
+                c.attr(label=part['title'], color='blue', style='dashed')
+                for mission in part['missions']:
+                    make_mission_node(graph, mission, layout)
+                    node_count += 1
+
+                    for dependency in mission['depends_on']:
+                        c.edge(dependency, mission['id'])
+                    edge_count += len(mission['depends_on'])
+        else:
+            for mission in part['missions']:
+                make_mission_node(graph, mission, layout)
+                node_count += 1
+
+                for dependency in mission['depends_on']:
+                    graph.edge(dependency, mission['id'])
+                edge_count += len(mission['depends_on'])
+
+    return node_count, edge_count
+
+
+def write_dot(file, parts, args, layout=None):
+    from dotwriter import DotWriter
+
+    writer = DotWriter(file, comment='Mission Dependency Graph')
+    set_graph_attrs(writer, args.dpi, layout)
+    build_graph(writer, parts, args.subgraphs, layout)
+    writer.close()
+
+
+def load_graph(parts, args):
+    from missiongraph import MissionGraph
+
+    with Profiler.stage('load_graph'):
+        graph = MissionGraph.from_parts(parts)
+    Logger.log_verbose('Loaded %d missions with %d dependencies', graph.get_mission_count(), graph.get_edge_count())
+
+    cycles = []
+    if args.check or args.reduce:
+        cycles = graph.find_cycles()
+
+    if args.check:
+        for mission_id, dependency in graph.find_dangling():
+            Logger.log_info('Mission %s depends on unknown mission %s', mission_id, dependency, color='yellow')
+        for cycle in cycles:
+            Logger.log_info('Dependency cycle: %s', ' -> '.join(cycle), color='red')
+
+    if args.reduce:
+        if len(cycles) > 0:
+            Logger.log_info('Not removing redundant dependencies because the graph has cycles', color='red')
+        else:
+            removed = graph.reduce()
+            Logger.log_info('Removed %d redundant dependencies', removed)
+
+    return graph
+
+
+def select_nodes(graph, args) -> set[int] | None:
+    seeds = set()
+    if args.part is not None:
+        part_index = graph.find_part(args.part)
+        if part_index is None:
+            Logger.log_info('No part found with the title "%s"', args.part, color='red')
+            return None
+        seeds |= graph.get_part_nodes(part_index)
+
+    if args.mission is not None:
+        node = graph.find_mission(args.mission)
+        if node is None:
+            Logger.log_info('No mission found with the id or title "%s"', args.mission, color='red')
+            return None
+        seeds.add(node)
+
+    if len(seeds) < 1:
+        return None
+
+    nodes = graph.get_closure(seeds, args.depth if args.depth >= 0 else None)
+    Logger.log_verbose('Selected %d of %d missions', len(nodes), len(graph.ids))
+    return nodes
+
+
+def render_job(source, engine, fmt, output_path) -> float:
+    # Runs in a worker process, so it only gets plain data
+    import drawio
+
+    start = time.perf_counter()
+    if fmt == 'drawio':
+        drawio.render(source, engine, output_path)
+    else:
+        result = subprocess.run([engine, f'-T{fmt}', '-o', output_path], input=source, encoding='utf-8',
+                                capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f'{engine} exited with code {result.returncode}')
+    return time.perf_counter() - start
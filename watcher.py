@@ -0,0 +1,259 @@
+#  Copyright 2024 Ryan Bester
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import mimetypes
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from graphviz.quoting import attr_list, quote
+
+from logger import Logger
+from missiongraph import MissionGraph
+from profiler import Profiler
+from styler import Styler
+from treegen import read_parts, render_job, select_nodes, set_graph_attrs
+
+
+# Takes the place of a graph for set_graph_attrs and Styler.make_node, and keeps the statements they make
+class GraphStatements:
+    def __init__(self):
+        self.attrs = []
+        self.statement = None
+
+    def attr(self, **kwargs):
+        for key, value in kwargs.items():
+            self.attrs.append(f'\t{quote(key)}={quote(value)}\n')
+
+    def node(self, name, label=None, _attributes=None, **attrs):
+        # Every attribute is written on the node itself, so its statement does not depend on the nodes around it
+        self.statement = f'\t{quote(name)}{attr_list(label, attrs, _attributes)}\n'
+
+
+# Keeps the missions, the compiled style and the statements of the last graph in memory, and renders the graph again
+# whenever the input, style or image files change. Only the statements of missions that changed, or whose style did,
+# are made again, and the graph is not laid out again when its source is the same as the last one.
+class TreeWatcher:
+    def __init__(self, args):
+        self.args = args
+        # Named like the output of generate-tree, where a drawio diagram takes the place of the source
+        self.render_name = args.output_file if args.format == 'drawio' else f'{args.output_file}.{args.format}'
+        # Path to the (modification time, size) it had when it was last read, or None if it did not exist
+        self.stats: dict[str, tuple[int, int] | None] = {}
+        self.parts: list[dict] = []
+        # Mission id to the title and style template its node statement was made with, and the statement
+        self.nodes: dict[str, tuple[str, tuple | None, str]] = {}
+        # Mission id to its dependencies and the edge statements made from them
+        self.edges: dict[str, tuple[tuple[str, ...], str]] = {}
+        self.source: str | None = None
+        self.output: bytes | None = None
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get_paths(self) -> list[str]:
+        paths = [self.args.input_file]
+        if self.args.style is not None:
+            paths.append(self.args.style)
+        return paths + sorted(Styler.get_image_paths())
+
+    @staticmethod
+    def get_stat(path: str) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_changed(self) -> set[str]:
+        changed = set()
+        for path in self.get_paths():
+            stat = TreeWatcher.get_stat(path)
+            if self.stats.get(path) != stat:
+                self.stats[path] = stat
+                changed.add(path)
+        return changed
+
+    def load_style(self) -> bool:
+        try:
+            Styler.load_style(self.args.style)
+        except (OSError, ValueError) as e:
+            Logger.log_info('Failed to load style "%s": %s', self.args.style, e, color='red')
+            return False
+        return True
+
+    def load_data(self) -> bool:
+        try:
+            parts = read_parts(self.args)
+            if parts is None:
+                return False
+            parts = [{'title': part['title'], 'missions': list(part['missions'])} for part in parts]
+        except (OSError, ValueError) as e:
+            Logger.log_info('Failed to read "%s": %s', self.args.input_file, e, color='red')
+            return False
+
+        if self.args.part is not None or self.args.mission is not None:
+            graph = MissionGraph.from_parts(parts)
+            nodes = select_nodes(graph, self.args)
+            if nodes is None:
+                return False
+            parts = [{'title': part['title'], 'missions': list(part['missions'])} for part in graph.to_parts(nodes)]
+
+        self.parts = parts
+        return True
+
+    def make_source(self) -> str:
+        with Profiler.stage('make_source'):
+            statements = GraphStatements()
+            set_graph_attrs(statements, self.args.dpi)
+
+            nodes = {}
+            edges = {}
+            made = 0
+            for part in self.parts:
+                for mission in part['missions']:
+                    mission_id = mission['id']
+                    template = Styler.get_node_template(mission_id, mission['tags'])
+                    node = self.nodes.get(mission_id)
+                    if node is None or node[0] != mission['title'] or node[1] != template:
+                        Styler.make_node(statements, mission_id, mission['title'], mission['tags'])
+                        node = (mission['title'], template, statements.statement)
+                        made += 1
+                    nodes[mission_id] = node
+
+                    depends_on = tuple(mission['depends_on'])
+                    edge = self.edges.get(mission_id)
+                    if edge is None or edge[0] != depends_on:
+                        indent = '\t\t' if self.args.subgraphs else '\t'
+                        edge = (depends_on, ''.join(f'{indent}{quote(dependency)} -> {quote(mission_id)}\n'
+                                                    for dependency in depends_on))
+                    edges[mission_id] = edge
+
+            # Missions that were removed are dropped along with their statements
+            self.nodes = nodes
+            self.edges = edges
+            Logger.log_verbose('Made %d of %d node statements', made, len(nodes))
+
+            source = ['// Mission Dependency Graph\n', 'digraph {\n', *statements.attrs]
+            source.extend(statement for _, _, statement in nodes.values())
+            for part in self.parts:
+                if self.args.subgraphs:
+                    source.append(f'\tsubgraph {quote("cluster_" + part["title"].replace(" ", "_"))} {{\n')
+                    source.append(f'\t\tlabel={quote(part["title"])}\n\t\tcolor=blue\n\t\tstyle=dashed\n')
+                source.extend(edges[mission['id']][1] for mission in part['missions'])
+                if self.args.subgraphs:
+                    source.append('\t}\n')
+            source.append('}\n')
+        return ''.join(source)
+
+    def render(self, force: bool = False):
+        source = self.make_source()
+        if source == self.source and not force:
+            Logger.log_info('Graph is unchanged', color='light_grey')
+            return
+
+        if self.args.format != 'drawio':
+            with open(self.args.output_file, 'w', encoding='utf-8') as f:
+                f.write(source)
+        try:
+            with Profiler.stage('layout'):
+                elapsed = render_job(source, self.args.engine, self.args.format, self.render_name)
+            with open(self.render_name, 'rb') as f:
+                output = f.read()
+        except (OSError, RuntimeError) as e:
+            Logger.log_info('Failed to render the graph: %s', e, color='red')
+            return
+
+        self.source = source
+        with self.lock:
+            self.output = output
+            self.version += 1
+        Logger.log_info('Graph saved as %s (laid out in %.2fs)', self.render_name, elapsed)
+
+    def update(self, changed: set[str]):
+        start = time.perf_counter()
+        if self.args.style in changed and not self.load_style():
+            return
+        if self.args.input_file in changed and not self.load_data():
+            return
+        # The images are only read by the layout engine, so a changed image does not change the source
+        self.render(force=len(changed - {self.args.input_file, self.args.style}) > 0)
+        Logger.log_verbose('Updated in %.2fs', time.perf_counter() - start)
+
+    def run(self):
+        loaded = self.load_style() and self.load_data()
+        self.get_changed()
+        if loaded:
+            self.render()
+
+        Logger.log_info('Watching %s for changes, press Ctrl+C to stop', ', '.join(self.get_paths()))
+        try:
+            while True:
+                time.sleep(self.args.interval)
+                changed = self.get_changed()
+                if len(changed) > 0:
+                    Logger.log_info('Changed: %s', ', '.join(sorted(changed)), color='cyan')
+                    self.update(changed)
+        except KeyboardInterrupt:
+            pass
+
+
+class WatchHandler(BaseHTTPRequestHandler):
+    server: 'WatchServer'
+
+    def do_GET(self):
+        watcher = self.server.watcher
+        with watcher.lock:
+            output = watcher.output
+            etag = f'"{watcher.version}"'
+
+        if self.path.split('?')[0] != '/' or output is None:
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(watcher.render_name)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(output)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, format, *args):
+        Logger.log_debug('Watch server: ' + format, *args)
+
+
+# Serves the last graph the watcher rendered
+class WatchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, watcher: TreeWatcher, host: str = '127.0.0.1', port: int = 8000):
+        super().__init__((host, port), WatchHandler)
+        self.watcher = watcher
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()